@@ -8,9 +8,9 @@ from .compute_sfs import expected_sfs, expected_total_branch_len, expected_sfs_t
 from .likelihood import SfsLikelihoodSurface
 from .confidence_region import ConfidenceRegion
 from .data.configurations import build_config_list
-from .data.sfs import site_freq_spectrum, Sfs
+from .data.sfs import site_freq_spectrum, Sfs, SfsBuilder
 from .data.tensor import sfs_tensor_prod
-from .data.snps import SnpAlleleCounts, snp_allele_counts
+from .data.snps import SnpAlleleCounts, snp_allele_counts, read_vcf_sfs
 from .demo_model import DemographicModel
 from .demo_plotter import DemographyPlot
 from .sfs_stats import SfsModelFitStats, JackknifeGoodnessFitStat
@@ -64,28 +64,58 @@ def expected_sfs(
 
 
 def _expected_sfs(demography, configs, folded, error_matrices):
+    vals, idxs = _expected_sfs_vals(
+        demography, configs, configs._vecs_and_idxs(folded), error_matrices)
+
+    #assert np.all(np.logical_or(vals >= 0.0, np.isclose(vals, 0.0)))
+
+    return _sfs_from_vals(vals, idxs, folded), _denom_from_vals(vals, idxs)
+
+
+def _expected_sfs_unnormalized(demography, configs, folded, error_matrices):
+    # the sfs entries of configs, without computing the normalization
+    # constant, which can be computed separately by _expected_sfs_denoms()
+    vals, idxs = _expected_sfs_vals(
+        demography, configs, configs._config_vecs_and_idxs(folded),
+        error_matrices)
+    return _sfs_from_vals(vals, idxs, folded)
+
+
+def _expected_sfs_denoms(demography, configs, folded, error_matrices):
+    # the normalization constant of each config,
+    # computed only from the normalization rows,
+    # which are shared by all subsets of configs
+    vals, idxs = _expected_sfs_vals(
+        demography, configs, configs._normalization_vecs_and_idxs(folded),
+        error_matrices)
+    return _denom_from_vals(vals, idxs)
+
+
+def _expected_sfs_vals(demography, configs, vecs_and_idxs, error_matrices):
     if np.any(configs.sampled_n != demography.sampled_n) or np.any(configs.sampled_pops != demography.sampled_pops):
         raise ValueError(
             "configs and demography must have same sampled_n, sampled_pops. Use Demography.copy() or ConfigList.copy() to make a copy with different sampled_n.")
 
-    vecs, idxs = configs._vecs_and_idxs(folded)
+    vecs, idxs = vecs_and_idxs
 
     if error_matrices is not None:
         vecs = _apply_error_matrices(vecs, error_matrices)
 
-    vals = expected_sfs_tensor_prod(vecs, demography)
+    return expected_sfs_tensor_prod(vecs, demography), idxs
+
 
+def _sfs_from_vals(vals, idxs, folded):
     sfs = vals[idxs['idx_2_row']]
     if folded:
         sfs = sfs + vals[idxs['folded_2_row']]
+    return sfs
+
 
+def _denom_from_vals(vals, idxs):
     denom = vals[idxs['denom_idx']]
     for i in (0, 1):
         denom = denom - vals[idxs[("corrections_2_denom", i)]]
-
-    #assert np.all(np.logical_or(vals >= 0.0, np.isclose(vals, 0.0)))
-
-    return sfs, denom
+    return denom
 
 
 def expected_total_branch_len(demography, error_matrices=None, ascertainment_pop=None,
@@ -8,8 +8,10 @@ from .data.snps import SnpAlleleCounts
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--out", default=None,
+                        help="Output file. If ends with .gz, gzip it. If ends with .momi, store it in binary format. Default is to print to stdout.")
     parser.add_argument("files", nargs="+",
-                        help="Files containing momi json data to concatenate")
+                        help="Files containing momi json or binary data to concatenate")
 
     args = parser.parse_args()
 
@@ -18,4 +20,4 @@ if __name__ == "__main__":
 
     SnpAlleleCounts.concatenate(
         SnpAlleleCounts.load(fname)
-        for fname in args.files).dump(sys.stdout)
+        for fname in args.files).dump(args.out or sys.stdout)
@@ -1,7 +1,8 @@
 from .compute_sfs import expected_sfs
-from .likelihood import _composite_log_likelihood
+from .likelihood import _composite_log_likelihood, _score_cov
 from .util import memoize_instance, make_constant, check_psd
 from .math_functions import inv_psd
+import concurrent.futures
 import scipy
 import scipy.stats
 import autograd
@@ -43,7 +44,7 @@ class _ConfidenceRegion(object):
                                                            scale=np.sqrt(np.diag(self.godambe(inverse=True))))
         return np.array([conf_lower, conf_upper]).T
 
-    def test(self, null_point, sims=int(1e3), test_type="ratio", alt_point=None, null_cone=None, alt_cone=None, p_only=True):
+    def test(self, null_point, sims=int(1e3), test_type="ratio", alt_point=None, null_cone=None, alt_cone=None, p_only=True, processes=None):
         """
         Returns p-value for a single or several hypothesis tests.
         By default, does a simple hypothesis test with the log-likelihood ratio.
@@ -92,6 +93,8 @@ class _ConfidenceRegion(object):
               [1] should generally be 0 in the interior of the parameter space.
               But on the boundary, the log likelihood ratio will frequently be 0,
               leading to a point mass at the boundary of the null distribution.
+        processes : if > 1, the simulated likelihood ratios for the "ratio"
+              test are computed in this many subprocesses
         """
         in_shape = np.broadcast(np.array(null_point), np.array(alt_point),
                                 np.array(null_cone), np.array(alt_cone)).shape
@@ -131,9 +134,11 @@ class _ConfidenceRegion(object):
             for nc, ac in zip(null_cone, alt_cone):
                 if (nc, ac) not in sim_mls:
                     nml, nmle = _project_scores(
-                        sims, self.fisher, nc, psd_rtol=self.psd_rtol)
+                        sims, self.fisher, nc, psd_rtol=self.psd_rtol,
+                        processes=processes)
                     aml, amle = _project_scores(
-                        sims, self.fisher, ac, psd_rtol=self.psd_rtol, init_vals=nmle)
+                        sims, self.fisher, ac, psd_rtol=self.psd_rtol, init_vals=nmle,
+                        processes=processes)
                     sim_mls[(nc, ac)] = (nml, aml)
 
             ret = []
@@ -263,21 +268,10 @@ def _observed_score_covariance(method, params, seg_sites, demo_func, psd_rtol, *
 
 
 def _many_score_cov(params, data, demo_func, **kwargs):
-    params = np.array(params)
-
-    def f_vec(x):
-        ret = _composite_log_likelihood(
-            data, demo_func(*x), vector=True, **kwargs)
-        # centralize
-        return ret - np.mean(ret)
-
-    # g_out = einsum('ij,ik', jacobian(f_vec)(params), jacobian(f_vec)(params))
-    # but computed in a roundabout way because jacobian implementation is slow
-    def _g_out_antihess(x):
-        l = f_vec(x)
-        lc = make_constant(l)
-        return np.sum(0.5 * (l**2 - l * lc - lc * l))
-    return autograd.hessian(_g_out_antihess)(params)
+    # g_out = einsum('ij,ik', jacobian(f_vec)(params), jacobian(f_vec)(params)),
+    # where f_vec is the centralized vector of per-locus log likelihoods,
+    # computed from the per-config gradients of the log SFS probabilities
+    return _score_cov(data, demo_func, params, **kwargs)
 
 
 def _long_score_cov(params, seg_sites, demo_func, **kwargs):
@@ -328,7 +322,7 @@ def _long_score_cov(params, seg_sites, demo_func, **kwargs):
     return g_out
 
 
-def _project_scores(simulated_scores, fisher_information, polyhedral_cone, psd_rtol, init_vals=None, method="tnc"):
+def _project_scores(simulated_scores, fisher_information, polyhedral_cone, psd_rtol, init_vals=None, method="active_set", processes=None):
     """
     Under usual theory, the score is asymptotically
     Gaussian, with covariance == Fisher information.
@@ -361,10 +355,28 @@ def _project_scores(simulated_scores, fisher_information, polyhedral_cone, psd_r
             0: parameter == 0
             1: parameter is >= 0
             -1: parameter is <= 0
+    method: "active_set" solves all the simulations at once
+        with a batched primal active-set method
+        (falling back to "l-bfgs-b" if the Fisher information is singular);
+        otherwise, the name of a scipy.optimize.minimize method,
+        called once per simulation.
+    processes: if > 1, split the simulations into chunks
+        solved in this many subprocesses
     """
     if init_vals is None:
         init_vals = np.zeros(simulated_scores.shape)
 
+    if processes is not None and processes > 1:
+        chunks = np.array_split(np.arange(len(simulated_scores)), processes)
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            results = [executor.submit(
+                _project_scores, simulated_scores[c], fisher_information,
+                polyhedral_cone, psd_rtol, init_vals[c], method)
+                       for c in chunks]
+            results = [r.result() for r in results]
+        liks, mles = zip(*results)
+        return np.concatenate(liks), np.concatenate(mles)
+
     fixed_params = [c == 0 for c in polyhedral_cone]
     if any(fixed_params):
         if all(fixed_params):
@@ -377,7 +389,8 @@ def _project_scores(simulated_scores, fisher_information, polyhedral_cone, psd_r
         init_vals = np.einsum("ij,kj->ik", init_vals, proj)
 
         liks, mles = _project_scores(
-            simulated_scores, fisher_information, polyhedral_cone, psd_rtol, init_vals, method)
+            simulated_scores, fisher_information, polyhedral_cone, psd_rtol, init_vals, method,
+            processes=processes)
         mles = np.einsum("ik,kj->ij", mles, proj)
         return liks, mles
     else:
@@ -407,6 +420,30 @@ def _project_scores(simulated_scores, fisher_information, polyhedral_cone, psd_r
 
         assert init_vals.shape == simulated_scores.shape
 
+        if method == "active_set":
+            signs = np.array([0 if c is None else c for c in polyhedral_cone])
+            try:
+                fisher_information = check_psd(
+                    fisher_information, tol=psd_rtol)
+                # the linear solves on the active sets need a nonsingular Fisher
+                if np.linalg.matrix_rank(fisher_information) < len(signs):
+                    raise np.linalg.LinAlgError("Singular matrix")
+                mles, converged = _active_set_qp(
+                    simulated_scores, fisher_information, signs, init_vals)
+            except (AssertionError, np.linalg.LinAlgError):
+                return _project_scores(
+                    simulated_scores, fisher_information, polyhedral_cone,
+                    psd_rtol, init_vals, method="l-bfgs-b")
+            liks = np.einsum("ij,ij->i", mles, simulated_scores)
+            liks = liks - .5 * np.einsum("ij,ij->i", mles,
+                                         np.dot(mles, fisher_information))
+            if not np.all(converged):
+                liks[~converged], mles[~converged] = _project_scores(
+                    simulated_scores[~converged], fisher_information,
+                    polyhedral_cone, psd_rtol, init_vals[~converged],
+                    method="l-bfgs-b")
+            return liks, mles
+
         def obj(x):
             return -np.dot(z, x) + .5 * np.dot(x, np.dot(fisher_information, x))
 
@@ -419,3 +456,72 @@ def _project_scores(simulated_scores, fisher_information, polyhedral_cone, psd_r
         liks = np.array([-s.fun for s in sols])
         mles = np.array([s.x for s in sols])
         return liks, mles
+
+
+def _active_set_qp(scores, fisher_information, signs, init_vals, tol=1e-10):
+    """
+    Minimizes -z*x + x*Fisher*x/2 subject to signs*x >= 0,
+    for every row z of scores at once, with a primal active-set method.
+
+    signs is 1, -1, or 0 (unconstrained) for each parameter.
+    Returns the minimizers, and a boolean array of which rows converged.
+    """
+    n_sims, n_params = scores.shape
+    constrained = signs != 0
+    x = np.where(signs * init_vals < 0, 0, init_vals)
+    active = constrained & (x == 0)
+
+    todo = np.arange(n_sims)
+    for _ in range(10 * (n_params + 1)):
+        if len(todo) == 0:
+            break
+        rows = np.arange(len(todo))
+        z, x_todo, active_todo = scores[todo], x[todo], active[todo]
+
+        # move towards the minimum on the current active set,
+        # stopping at the first constraint in the way
+        direction = _solve_free_qp(
+            z, fisher_information, active_todo) - x_todo
+        blocking = constrained & ~active_todo & (signs * direction < 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            steps = np.where(blocking, -x_todo / direction, np.inf)
+        first = np.argmin(steps, axis=1)
+        step = np.clip(steps[rows, first], 0, 1)
+        x_todo = x_todo + step[:, None] * direction
+
+        blocked = step < 1
+        active_todo[rows[blocked], first[blocked]] = True
+        x_todo[active_todo] = 0
+
+        # at the minimum of the active set, release the constraint
+        # with the most negative Lagrange multiplier, if any
+        lagrange = signs * (np.dot(x_todo, fisher_information) - z)
+        lagrange = np.where(active_todo, lagrange, np.inf)
+        release = np.argmin(lagrange, axis=1)
+        optimal = ~blocked & (lagrange[rows, release] >= -tol * (
+            1 + np.max(np.abs(z), axis=1)))
+        dropped = ~blocked & ~optimal
+        active_todo[rows[dropped], release[dropped]] = False
+
+        x[todo], active[todo] = x_todo, active_todo
+        todo = todo[~optimal]
+
+    converged = np.ones(n_sims, dtype=bool)
+    converged[todo] = False
+    return x, converged
+
+
+def _solve_free_qp(scores, fisher_information, active):
+    # minimum of -z*x + x*Fisher*x/2 with the active parameters fixed at 0,
+    # with one linear solve per distinct active set
+    ret = np.zeros(scores.shape)
+    patterns, inverse = np.unique(active, axis=0, return_inverse=True)
+    for i, pattern in enumerate(patterns):
+        free = np.arange(len(pattern))[~pattern]
+        if len(free) == 0:
+            continue
+        rows = np.arange(len(scores))[inverse == i]
+        ret[np.ix_(rows, free)] = np.linalg.solve(
+            fisher_information[np.ix_(free, free)],
+            scores[np.ix_(rows, free)].T).T
+    return ret
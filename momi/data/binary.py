@@ -0,0 +1,80 @@
+"""Binary container for numpy arrays, memory-mapped when loading.
+
+The file begins with a magic string and the byte length of a JSON header,
+followed by the header itself, and then the raw (C-ordered) arrays,
+each aligned to 64 bytes. The header stores the dtype, shape and offset
+of each array, along with any other (JSON serializable) metadata.
+"""
+
+import os
+import json
+import struct
+# autograd.numpy.array() inefficient, so use vanilla numpy here
+import numpy as np
+
+BINARY_EXTENSION = ".momi"
+
+_MAGIC = b"\x93MOMI\x01"
+_ALIGN = 64
+
+
+def _is_binary_file(f):
+    return isinstance(f, str) and f.endswith(BINARY_EXTENSION)
+
+
+def _aligned(n_bytes):
+    return -(-n_bytes // _ALIGN) * _ALIGN
+
+
+def _dump_arrays(fname, kind, arrays, **info):
+    header = {"kind": kind, "info": info, "arrays": {}}
+    arrays = {name: np.ascontiguousarray(arr)
+              for name, arr in arrays.items()}
+    offset = 0
+    for name, arr in arrays.items():
+        if arr.dtype.hasobject:
+            raise ValueError("Cannot store object array {}".format(name))
+        header["arrays"][name] = {"dtype": arr.dtype.str,
+                                  "shape": list(arr.shape),
+                                  "offset": offset}
+        offset += _aligned(arr.nbytes)
+
+    header = json.dumps(header).encode()
+    prefix_len = len(_MAGIC) + 8 + len(header)
+    with open(os.path.expanduser(fname), "wb") as f:
+        f.write(_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(b"\0" * (_aligned(prefix_len) - prefix_len))
+        for arr in arrays.values():
+            f.write(memoryview(arr.reshape(-1)).cast("B"))
+            f.write(b"\0" * (_aligned(arr.nbytes) - arr.nbytes))
+
+
+def _load_arrays(fname, kind, mmap=True):
+    fname = os.path.expanduser(fname)
+    with open(fname, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise IOError("{} is not a momi binary file".format(fname))
+        header_len, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len).decode())
+    if header["kind"] != kind:
+        raise IOError("{} contains {}, not {}".format(
+            fname, header["kind"], kind))
+
+    data_start = _aligned(len(_MAGIC) + 8 + header_len)
+    arrays = {}
+    for name, arr_info in header["arrays"].items():
+        dtype = np.dtype(arr_info["dtype"])
+        shape = tuple(arr_info["shape"])
+        offset = data_start + arr_info["offset"]
+        if mmap and np.prod(shape) > 0:
+            # copy-on-write, so in-place changes never touch the file
+            arrays[name] = np.memmap(fname, dtype=dtype, mode="c",
+                                     offset=offset, shape=shape)
+        else:
+            with open(fname, "rb") as f:
+                f.seek(offset)
+                arrays[name] = np.fromfile(
+                    f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return arrays, header["info"]
@@ -17,6 +17,61 @@ def _hashed2config(config_str):
                               for x in config_str.strip().split()))
 
 
+def _hash_configs(config_array):
+    """
+    Encode each config (row of config_array) as a single integer,
+    reading its counts as the digits of a mixed-radix number,
+    with the radix of each digit given by its range of counts.
+
+    If the encoding would overflow int64, returns a structured (void)
+    view of each row instead, which can still be sorted and compared.
+    """
+    config_array = np.asarray(config_array, dtype=np.int64)
+    digits = config_array.reshape((len(config_array), -1))
+    if len(digits) == 0:
+        return np.zeros(0, dtype=np.int64)
+    digits = digits - digits.min(axis=0)
+    radix = digits.max(axis=0) + 1
+    if np.sum(np.log2(radix)) < 62:
+        place = np.append(np.cumprod(radix[:0:-1])[::-1], 1)
+        return digits.dot(place)
+    else:
+        digits = np.ascontiguousarray(digits)
+        return digits.view(
+            np.dtype((np.void, digits.itemsize * digits.shape[1]))
+        ).reshape(-1)
+
+
+def _unique_configs(config_array):
+    """
+    Returns the unique configs of config_array, in order of first
+    appearance, and the index of each config in the unique configs.
+    """
+    config_array = np.asarray(config_array, dtype=int)
+    if len(config_array) == 0:
+        return config_array, np.zeros(0, dtype=int)
+    _, first, inverse = np.unique(_hash_configs(config_array),
+                                  return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=int)
+    rank[order] = np.arange(len(order))
+    return config_array[first[order]], rank[inverse]
+
+
+def _merge_config_arrays(config_arrays):
+    """
+    Union of several arrays of unique configs.
+
+    Returns the array of unique configs, in order of first appearance,
+    and for each input array, the index of each of its configs
+    in the returned array.
+    """
+    config_arrays = [np.asarray(c, dtype=int) for c in config_arrays]
+    lengths = [len(c) for c in config_arrays]
+    uniq, index2uniq = _unique_configs(np.concatenate(config_arrays))
+    return uniq, np.split(index2uniq, np.cumsum(lengths)[:-1])
+
+
 class _CompressedList(object):
     def __init__(self, items=None):
         self.uniq_values = []
@@ -28,6 +83,32 @@ class _CompressedList(object):
             for i in items:
                 self.append(i)
 
+    @classmethod
+    def _from_index2uniq(cls, uniq_values, index2uniq):
+        ret = cls()
+        ret.uniq_values = list(uniq_values)
+        ret.value2uniq = {v: i for i, v in enumerate(ret.uniq_values)}
+        ret.index2uniq = index2uniq
+        return ret
+
+    @classmethod
+    def _concatenate(cls, lists):
+        ret = cls()
+        index2uniq = [np.zeros(0, dtype=int)]
+        for lst in lists:
+            old2new = []
+            for value in lst.uniq_values:
+                try:
+                    old2new.append(ret.value2uniq[value])
+                except KeyError:
+                    old2new.append(len(ret.uniq_values))
+                    ret.value2uniq[value] = len(ret.uniq_values)
+                    ret.uniq_values.append(value)
+            index2uniq.append(
+                np.array(old2new, dtype=int)[lst._get_array()])
+        ret.index2uniq = np.concatenate(index2uniq)
+        return ret
+
     def __eq__(self, other):
         return list(self) == list(other)
 
@@ -46,7 +127,7 @@ class _CompressedList(object):
 
     def _get_array(self):
         if self._array is None:
-            self._array = np.array(self.index2uniq, dtype=int)
+            self._array = np.asarray(self.index2uniq, dtype=int)
         return self._array
 
     def append(self, value):
@@ -65,40 +146,144 @@ class _CompressedList(object):
 
 
 class _CompressedHashedCounts(object):
+    # configs are buffered, and deduplicated a chunk at a time
+    # with _merge_config_arrays, rather than hashed one by one
+    _min_chunk = 2**16
+
     def __init__(self, npops):
-        self.compressed_list = _CompressedList()
         self.npops = npops
+        self._uniq = np.zeros((0, npops, 2), dtype=int)
+        self._index2uniq = [np.zeros(0, dtype=int)]
+        self._buffer = []
+        self._len = 0
 
     def __len__(self):
-        return len(self.compressed_list)
+        return self._len
 
     def append(self, config):
-        self.compressed_list.append(_config2hashable(config))
+        self._buffer.append(np.array(config, dtype=int))
+        self._len += 1
+        if len(self._buffer) >= max(self._min_chunk, len(self._uniq)):
+            self._flush()
+
+    def extend(self, config_array):
+        config_array = np.asarray(config_array, dtype=int).reshape(
+            (-1, self.npops, 2))
+        self._flush()
+        self._buffer = [config_array]
+        self._len += len(config_array)
+        self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            chunk = np.array(self._buffer, dtype=int).reshape(
+                (-1, self.npops, 2))
+            self._buffer = []
+            self._uniq, (_, chunk_index2uniq) = _merge_config_arrays(
+                [self._uniq, chunk])
+            self._index2uniq.append(chunk_index2uniq)
 
     def index2uniq(self, i=None):
+        self._flush()
+        if len(self._index2uniq) > 1:
+            self._index2uniq = [np.concatenate(self._index2uniq)]
         if i is None:
-            return self.compressed_list.index2uniq
+            return self._index2uniq[0]
         else:
-            return self.compressed_list.index2uniq[i]
+            return self._index2uniq[0][i]
 
     def config_array(self):
-        ret = np.zeros((len(self.compressed_list.uniq_values), self.npops, 2),
-                       dtype=int)
-        for i, config_str in enumerate(self.compressed_list.uniq_values):
-            ret[i, :, :] = _hashed2config(config_str)
-        return ret
+        self._flush()
+        return self._uniq
 
     def compressed_allele_counts(self):
         return CompressedAlleleCounts(self.config_array(),
                                       self.index2uniq())
 
 
+class _BlockedConfigCounts(object):
+    # counts of each config in each block, without storing the config
+    # of each SNP; configs are deduplicated a chunk at a time
+    # as in _CompressedHashedCounts, and the counts kept in a sparse matrix
+    _min_chunk = 2**16
+
+    def __init__(self, npops):
+        self.npops = npops
+        self.n_blocks = 0
+        self._uniq = np.zeros((0, npops, 2), dtype=int)
+        self._counts = scipy.sparse.coo_matrix((0, 0), dtype=int)
+        self._buffer = []
+        self._buffer_blocks = []
+
+    def append(self, block, config):
+        self._buffer.append(np.array(config, dtype=int))
+        self._buffer_blocks.append(block)
+        self.n_blocks = max(self.n_blocks, block + 1)
+        if len(self._buffer) >= self._min_chunk:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            chunk = np.array(self._buffer, dtype=int).reshape(
+                (-1, self.npops, 2))
+            blocks = np.array(self._buffer_blocks, dtype=int)
+            self._buffer, self._buffer_blocks = [], []
+            # the previous unique configs keep their indices
+            self._uniq, (_, chunk_index2uniq) = _merge_config_arrays(
+                [self._uniq, chunk])
+            self._add(chunk_index2uniq, blocks,
+                      np.ones(len(blocks), dtype=int))
+
+    def _add(self, rows, cols, data):
+        counts = self._counts
+        self._counts = scipy.sparse.coo_matrix(
+            (np.concatenate([counts.data, data]),
+             (np.concatenate([counts.row, rows]),
+              np.concatenate([counts.col, cols]))),
+            shape=(len(self._uniq), self.n_blocks))
+        self._counts.sum_duplicates()
+
+    def add_counts(self, config_array, counts, old2new_block):
+        # add a sparse (config x block) matrix of counts of config_array,
+        # with its block i becoming block old2new_block[i]
+        self._flush()
+        self._uniq, (_, old2new_uniq) = _merge_config_arrays(
+            [self._uniq, config_array])
+        old2new_block = np.asarray(old2new_block, dtype=int)
+        self.n_blocks = max(self.n_blocks,
+                            np.max(old2new_block, initial=-1) + 1)
+        counts = counts.tocoo()
+        self._add(old2new_uniq[counts.row], old2new_block[counts.col],
+                  counts.data)
+
+    def merge_blocks(self, old2new_block):
+        # merge blocks, with old block i becoming block old2new_block[i]
+        self._flush()
+        old2new_block = np.asarray(old2new_block, dtype=int)
+        counts = self._counts
+        self._counts = scipy.sparse.coo_matrix((0, 0), dtype=int)
+        self.n_blocks = np.max(old2new_block, initial=-1) + 1
+        self._add(counts.row, old2new_block[counts.col], counts.data)
+
+    def config_array(self):
+        self._flush()
+        return self._uniq
+
+    def counts(self):
+        # sparse (config x block) matrix of counts
+        self._flush()
+        return self._counts.tocsr()
+
+
 class CompressedAlleleCounts(object):
     @classmethod
     def from_iter(cls, config_iter, npops, sort=True):
         compressed_hashes = _CompressedHashedCounts(npops)
-        for config in config_iter:
-            compressed_hashes.append(config)
+        if isinstance(config_iter, np.ndarray):
+            compressed_hashes.extend(config_iter)
+        else:
+            for config in config_iter:
+                compressed_hashes.append(config)
         return cls(compressed_hashes.config_array(),
                    compressed_hashes.index2uniq(),
                    sort=sort)
@@ -106,7 +291,7 @@ class CompressedAlleleCounts(object):
     def __init__(self, config_array, index2uniq,
                  sort=True):
         self.config_array = config_array
-        self.index2uniq = np.array(index2uniq, dtype=int)
+        self.index2uniq = np.asarray(index2uniq, dtype=int)
         if sort:
             self.sort_configs()
 
@@ -140,20 +325,20 @@ class CompressedAlleleCounts(object):
         d = self.config_array[:, :, 1]  # derived counts
         n = a + d  # totals
 
-        n = list(map(tuple, n))
-        a = list(map(tuple, a))
-        d = list(map(tuple, d))
-
-        folded = list(map(min, list(zip(a, d))))
+        # folded = min(tuple(a), tuple(d)), compared lexicographically
+        differs = a != d
+        first_diff = np.argmax(differs, axis=1)
+        rows = np.arange(len(a))
+        a_is_min = a[rows, first_diff] <= d[rows, first_diff]
+        folded = np.where(a_is_min[:, np.newaxis], a, d)
 
-        keys = list(zip(n, folded))
-        sorted_idxs = sorted(range(len(n)), key=lambda i: keys[i])
-        sorted_idxs = np.array(sorted_idxs, dtype=int)
+        # sort by n, then folded (lexsort takes the primary key last);
+        # lexsort is stable, so ties keep their current order
+        keys = np.concatenate([folded[:, ::-1], n[:, ::-1]], axis=1)
+        sorted_idxs = np.lexsort(keys.T)
 
-        unsorted_idxs = [None] * len(sorted_idxs)
-        for i, j in enumerate(sorted_idxs):
-            unsorted_idxs[j] = i
-        unsorted_idxs = np.array(unsorted_idxs, dtype=int)
+        unsorted_idxs = np.empty(len(sorted_idxs), dtype=int)
+        unsorted_idxs[sorted_idxs] = np.arange(len(sorted_idxs))
 
         self.config_array = self.config_array[sorted_idxs, :, :]
         self.index2uniq = unsorted_idxs[self.index2uniq]
@@ -1,8 +1,8 @@
 import itertools as it
 import autograd.numpy as np
 from scipy.special import comb
-from .compressed_counts import _config2hashable
 from ..util import memoize_instance
+from ..math_functions import log_factorial_table
 
 
 def build_config_list(sampled_pops, counts, sampled_n=None, ascertainment_pop=None):
@@ -43,6 +43,38 @@ def build_full_config_list(sampled_pops, sampled_n, ascertainment_pop=None):
         ascertainment_pop=ascertainment_pop)
 
 
+def _leaf_vecs(configs, n):
+    """
+    Returns the likelihood vectors of configs at a leaf with n alleles,
+    where configs[i] = (ancestral, derived) allele counts.
+
+    ret[i, d] is the hypergeometric probability of subsampling
+    configs[i] when d of the n alleles are derived.
+    It is computed from the table of log factorials,
+    so it doesn't overflow for large n.
+    Configs with negative counts have probability 0.
+    """
+    log_fact = log_factorial_table(n)
+    anc = configs[:, 0, np.newaxis]
+    der = configs[:, 1, np.newaxis]
+    derived = np.arange(n + 1)
+
+    # alleles not subsampled
+    rest_der = derived - der
+    rest_anc = n - derived - anc
+    valid = (anc >= 0) & (der >= 0) & (rest_der >= 0) & (rest_anc >= 0)
+
+    anc, der = np.maximum(anc, 0), np.maximum(der, 0)
+    rest_der = np.where(valid, rest_der, 0)
+    rest_anc = np.where(valid, rest_anc, 0)
+    log_ret = (log_fact[derived] + log_fact[n - derived]
+               - log_fact[rest_der] - log_fact[der]
+               - log_fact[rest_anc] - log_fact[anc]
+               + log_fact[anc + der] + log_fact[n - anc - der]
+               - log_fact[n])
+    return np.exp(np.where(valid, log_ret, -np.inf))
+
+
 class ConfigList(object):
     """
     Stores a list of configs. Important methods/attributes:
@@ -194,22 +226,54 @@ class ConfigList(object):
         augmented_configs = self._augmented_configs(folded)
         augmented_idxs = self._augmented_idxs(folded)
 
-        # construct the vecs
-        vecs = [np.zeros((len(augmented_configs), n + 1))
-                for n in self.sampled_n]
+        # copy augmented_idxs to make it safe
+        return self._leaf_vecs(augmented_configs), dict(augmented_idxs)
+
+    def _config_vecs_and_idxs(self, folded):
+        # like _vecs_and_idxs, but only with the rows of the configs
+        # (idx_2_row, folded_2_row), without the normalization rows
+        rows, idxs = self._config_idxs(folded)
+        augmented_configs = self._augmented_configs(folded)[rows, :, :]
+        return self._leaf_vecs(augmented_configs), dict(idxs)
+
+    def _normalization_vecs_and_idxs(self, folded):
+        # like _vecs_and_idxs, but only with the normalization rows
+        # (denom_idx, corrections_2_denom)
+        rows, idxs = self._normalization_idxs(folded)
+        augmented_configs = self._augmented_configs(folded)[rows, :, :]
+        return self._leaf_vecs(augmented_configs), dict(idxs)
+
+    def _leaf_vecs(self, augmented_configs):
+        return [_leaf_vecs(augmented_configs[:, i, :], n)
+                for i, n in enumerate(self.sampled_n)]
 
-        for i in range(len(vecs)):
-            n = self.sampled_n[i]
-            derived = np.einsum(
-                "i,j->ji", np.ones(len(augmented_configs)), np.arange(n + 1))
-            curr = (comb(derived, augmented_configs[:, i, 1])
-                    * comb(n - derived, augmented_configs[:, i, 0])
-                    / comb(n, np.sum(augmented_configs[:, i, :], axis=1)))
-            assert not np.any(np.isnan(curr))
-            vecs[i] = np.transpose(curr)
+    @memoize_instance
+    def _config_idxs(self, folded):
+        idxs = self._augmented_idxs(folded)
+        config_keys = [k for k in ("idx_2_row", "folded_2_row") if k in idxs]
+        rows, inverse = np.unique(np.concatenate(
+            [idxs[k] for k in config_keys]), return_inverse=True)
+        return rows, dict(zip(config_keys,
+                              np.split(inverse, len(config_keys))))
 
-        # copy augmented_idxs to make it safe
-        return vecs, dict(augmented_idxs)
+    @memoize_instance
+    def _normalization_idxs(self, folded):
+        """
+        Returns the rows of the augmented configs for the normalization
+        constant and the monomorphic corrections, along with the indices
+        into these rows of 'denom_idx' and ('corrections_2_denom', i).
+
+        These rows are the same for every subset of the configs,
+        so _ConfigList_Subset shares them instead of recomputing them.
+        """
+        idxs = self._augmented_idxs(folded)
+        corrections_keys = [("corrections_2_denom", i) for i in (0, 1)]
+        rows, inverse = np.unique(np.concatenate(
+            [[idxs["denom_idx"]]] + [idxs[k] for k in corrections_keys]),
+                                  return_inverse=True)
+        norm_idxs = {"denom_idx": inverse[0]}
+        norm_idxs.update(zip(corrections_keys, np.split(inverse[1:], 2)))
+        return rows, norm_idxs
 
     # def _config_str_iter(self):
     #     for c in self.value:
@@ -223,88 +287,64 @@ class ConfigList(object):
 
     @memoize_instance
     def _build_augmented_configs_idxs(self, folded):
-        augmented_configs = []
-        augmented_config_2_idx = {}  # maps config -> row in vecs
-
-        def augmented_idx(config):
-            hashed = _config2hashable(config)
-            try:
-                return augmented_config_2_idx[hashed]
-            except KeyError:
-                idx = len(augmented_configs)
-                assert idx == len(augmented_config_2_idx)
-
-                augmented_config_2_idx[hashed] = idx
-                augmented_configs.append(config)
-                return idx
+        configs = np.array(self.value, dtype=int)
+        n_pops = len(self.sampled_pops)
 
-        # initial row is a "zero" config
-        null_idx = augmented_idx(
-            np.array([(-1, 1)] * len(self.sampled_pops), dtype=int))
-
-        # next row is normalization constant
-        denom_idx = augmented_idx(np.zeros((len(self.sampled_pops), 2)))
+        # get the sample sizes of each config
+        sample_sizes_array = np.sum(configs, axis=2)
+        if np.any(sample_sizes_array > self.sampled_n):
+            raise Exception("There is a config that is larger than the"
+                            " specified sample size!")
+        uniq_sample_sizes, sample_sizes_inverse = np.unique(
+            sample_sizes_array, axis=0, return_inverse=True)
 
-        # get row indices for each config
-        idx_2_row = np.array(list(map(augmented_idx, self)), dtype=int)
+        # corrections for monomorphic sites (all ancestral & all derived)
+        mono_sizes = uniq_sample_sizes * self.ascertainment_pop
+        mono_zeros = np.zeros(mono_sizes.shape, dtype=int)
+        mono_configs = [np.stack([mono_sizes, mono_zeros], axis=2),
+                        np.stack([mono_zeros, mono_sizes], axis=2)]
+
+        # candidate rows: a "zero" config, the normalization constant,
+        # the configs, the monomorphic corrections,
+        # and the reversed configs if folded
+        candidates = [np.array([[(-1, 1)] * n_pops], dtype=int),
+                      np.zeros((1, n_pops, 2), dtype=int),
+                      configs] + mono_configs
+        if folded:
+            candidates.append(configs[:, :, ::-1])
+
+        # map each candidate to a row of augmented_configs
+        augmented_configs, candidate_2_row = np.unique(
+            np.concatenate(candidates).reshape(-1, 2 * n_pops),
+            axis=0, return_inverse=True)
+        augmented_configs = augmented_configs.reshape(-1, n_pops, 2)
+        candidate_rows = np.split(
+            candidate_2_row, np.cumsum([len(c) for c in candidates])[:-1])
+        null_idx, denom_idx = candidate_rows[0][0], candidate_rows[1][0]
+        idx_2_row = candidate_rows[2]
+        corrections_2_denom = [corr_rows[sample_sizes_inverse]
+                               for corr_rows in candidate_rows[3:5]]
 
         # remove monomorphic configs
         # (if there is missing data or error matrices,
         # expected_sfs_tensor_prod will return nonzero SFS
         # for monomorphic configs)
-        monomorphic = np.any(np.sum(self.value, axis=1) == 0, axis=1)
+        monomorphic = np.any(np.sum(configs, axis=1) == 0, axis=1)
         idx_2_row[monomorphic] = null_idx
 
-        # get row indices for each denominator
-        sample_sizes_array = np.sum(self.value, axis=2)
-        if np.any(sample_sizes_array > self.sampled_n):
-            raise Exception("There is a config that is larger than the"
-                            " specified sample size!")
-
-        sample_sizes = [tuple(s) for s in sample_sizes_array]
-        # corrections for monomorphic sites (all ancestral & all derived)
-        ssize_2_corrections = [{}, {}]
-        for s in set(sample_sizes):
-            # add rows for monomorphic correction terms
-            for mono_allele in (0, 1):
-                mono_config = tuple(ss if asc else 0 for ss,
-                                    asc in zip(s, self.ascertainment_pop))
-                mono_config = np.array(
-                    [mono_config, [0] * len(mono_config)], dtype=int, ndmin=2)
-                if mono_allele == 1:
-                    mono_config = mono_config[::-1, :]
-                mono_config = np.transpose(mono_config)
-                ssize_2_corrections[mono_allele][
-                    s] = augmented_idx(mono_config)
-        corrections_2_denom = [np.array([corr_row[s] for s in sample_sizes],
-                                        dtype=int)
-                               for corr_row in ssize_2_corrections]
-
-        # get row indices for folded configs
-        if folded:
-            rev_confs = self.value[:, :, ::-1]
-            is_symm = np.all(self.value == rev_confs, axis=(1, 2))
-            folded_2_row = []
-            for rc, symm in zip(rev_confs, is_symm):
-                if symm:
-                    # map to 0 if symmetric
-                    folded_2_row += [null_idx]
-                else:
-                    folded_2_row += [augmented_idx(rc)]
-            folded_2_row = np.array(folded_2_row, dtype=int)
-            # dont use monomorphic configs
-            folded_2_row[monomorphic] = null_idx
-
         idxs = {'denom_idx': denom_idx, 'idx_2_row': idx_2_row}
-        assert len(corrections_2_denom) == 2
         idxs.update({('corrections_2_denom', 0): corrections_2_denom[0],
                      ('corrections_2_denom', 1): corrections_2_denom[1]})
-        try:
+
+        # get row indices for folded configs
+        if folded:
+            folded_2_row = candidate_rows[5]
+            # map to 0 if symmetric, and dont use monomorphic configs
+            is_symm = np.all(configs == configs[:, :, ::-1], axis=(1, 2))
+            folded_2_row[is_symm | monomorphic] = null_idx
             idxs['folded_2_row'] = folded_2_row
-        except UnboundLocalError:
-            pass
 
-        return np.array(augmented_configs, dtype=int), idxs
+        return augmented_configs, idxs
 
 
 class _ConfigList_Subset(ConfigList):
@@ -353,19 +393,23 @@ class _ConfigList_Subset(ConfigList):
     @memoize_instance
     def _build_old_new_idxs(self, folded):
         idxs = self.full_configs._augmented_idxs(folded)
-
-        denom_idx_key = 'denom_idx'
-        denom_idx = idxs[denom_idx_key]
-        idxs = {k: v[self.sub_idxs]
-                for k, v in list(idxs.items()) if k != denom_idx_key}
-
-        old_idxs = np.array(
-            list(set(sum(map(list, idxs.values()), [denom_idx]))))
-        old_2_new_idxs = {old_id: new_id for new_id,
-                          old_id in enumerate(old_idxs)}
-
-        idxs = {k: np.array([old_2_new_idxs[old_id]
-                             for old_id in v], dtype=int)
-                for k, v in list(idxs.items())}
-        idxs[denom_idx_key] = old_2_new_idxs[denom_idx]
-        return old_idxs, idxs
+        norm_rows, norm_idxs = self.full_configs._normalization_idxs(folded)
+        config_keys = [k for k in ("idx_2_row", "folded_2_row") if k in idxs]
+        corrections_keys = [("corrections_2_denom", i) for i in (0, 1)]
+
+        # the normalization rows used by the subset come first,
+        # followed by the rows of its configs
+        used_norm, norm_inverse = np.unique(np.concatenate(
+            [[norm_idxs["denom_idx"]]] + [norm_idxs[k][self.sub_idxs]
+                                          for k in corrections_keys]),
+                                            return_inverse=True)
+        config_rows, config_inverse = np.unique(np.concatenate(
+            [idxs[k][self.sub_idxs] for k in config_keys]),
+                                                return_inverse=True)
+        old_idxs = np.concatenate([norm_rows[used_norm], config_rows])
+
+        new_idxs = {"denom_idx": norm_inverse[0]}
+        new_idxs.update(zip(corrections_keys, np.split(norm_inverse[1:], 2)))
+        new_idxs.update(zip(config_keys, np.split(
+            len(used_norm) + config_inverse, len(config_keys))))
+        return old_idxs, new_idxs
@@ -3,6 +3,7 @@ import collections as co
 import json
 import autograd.numpy as np
 import numpy as raw_np
+from autograd.extend import primitive, defvjp
 from cached_property import cached_property
 import scipy
 import scipy.sparse
@@ -10,10 +11,13 @@ import gzip
 import os
 import logging
 from .compressed_counts import _hashed2config, _config2hashable
-from .compressed_counts import CompressedAlleleCounts
+from .compressed_counts import (
+    CompressedAlleleCounts, _unique_configs, _merge_config_arrays)
 from .configurations import ConfigList
 from .configurations import _ConfigList_Subset
+from .binary import _is_binary_file, _dump_arrays, _load_arrays
 from ..util import memoize_instance
+from ..math_functions import hypergeom_mat
 
 
 def site_freq_spectrum(sampled_pops, freqs_by_locus, length=None):
@@ -88,9 +92,14 @@ class Sfs(object):
     def load(cls, f):
         """Load :class:`Sfs` from file created by :meth:`Sfs.dump` or ``python -m momi.extract_sfs``
 
-        :param str,file f: file object or file name to read in
+        :param str,file f: file object or file name to read in. \
+        If the name ends with ".momi", it is read as a binary file \
+        (see :meth:`Sfs.dump`), whose arrays are memory-mapped.
         :rtype: :class:`Sfs`
         """
+        if _is_binary_file(f):
+            return cls._load_binary(f)
+
         if isinstance(f, str):
             fname = os.path.expanduser(f)
             if fname.endswith(".gz"):
@@ -125,6 +134,32 @@ class Sfs(object):
 
         return ret
 
+    @classmethod
+    def _load_binary(cls, fname):
+        arrays, info = _load_arrays(fname, "Sfs")
+        configs = ConfigList(info.pop("sampled_pops"), arrays["configs"],
+                             sampled_n=arrays["sampled_n"],
+                             ascertainment_pop=arrays["ascertainment_pop"])
+        freqs_matrix = scipy.sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=(len(configs), info.pop("n_loci")))
+        return cls._from_csr(freqs_matrix, configs, **info)
+
+    @classmethod
+    def _from_csr(cls, csr_freqs_matrix, configs, folded, length):
+        # construct directly from the (configs x loci) frequency matrix;
+        # the per-locus idxs and counts are only split out when needed
+        ret = cls.__new__(cls)
+        ret.folded = folded
+        ret._length = length
+        ret.configs = configs
+        ret._n_loci = csr_freqs_matrix.shape[1]
+        ret.csr_freqs_matrix = csr_freqs_matrix
+        ret._total_freqs = raw_np.asarray(
+            csr_freqs_matrix.sum(axis=1)).reshape(-1)
+        assert not np.any(ret._total_freqs == 0)
+        return ret
+
     def __init__(self, loci, configs, folded, length):
         self.folded = folded
         self._length = length
@@ -150,6 +185,7 @@ class Sfs(object):
                     idxs, cnts = zip(*loc.items())
                 self.loc_idxs.append(np.array(idxs, dtype=int))
                 self.loc_counts.append(np.array(cnts, dtype=float))
+        self._n_loci = len(self.loc_idxs)
 
         if len(self.loc_idxs) > 1:
             self._total_freqs = np.array(np.squeeze(np.asarray(
@@ -167,8 +203,13 @@ class Sfs(object):
     def dump(self, f):
         """Write Sfs to file
 
-        :param str,file f: Filename or object. If name ends with ".gz" gzip it.
+        :param str,file f: Filename or object. If name ends with ".gz" gzip it. \
+        If it ends with ".momi", write a binary file instead, \
+        storing the configs and sparse frequency matrix as raw arrays.
         """
+        if _is_binary_file(f):
+            return self._dump_binary(f)
+
         if isinstance(f, str):
             fname = os.path.expanduser(f)
             if fname.endswith(".gz"):
@@ -212,6 +253,42 @@ class Sfs(object):
         print("\t]", file=f)
         print("}", file=f)
 
+    def _dump_binary(self, fname):
+        freqs_matrix = self.csr_freqs_matrix
+        if not freqs_matrix.has_canonical_format:
+            freqs_matrix = freqs_matrix.copy()
+            freqs_matrix.sum_duplicates()
+        _dump_arrays(
+            fname, "Sfs",
+            {"configs": raw_np.asarray(self.configs.value, dtype=int),
+             "sampled_n": raw_np.asarray(self.sampled_n, dtype=int),
+             "ascertainment_pop": raw_np.asarray(self.ascertainment_pop,
+                                                 dtype=bool),
+             "data": raw_np.asarray(freqs_matrix.data, dtype=float),
+             "indices": freqs_matrix.indices,
+             "indptr": freqs_matrix.indptr},
+            sampled_pops=list(self.sampled_pops),
+            n_loci=self.n_loci,
+            folded=bool(self.folded),
+            length=self._length)
+
+    @cached_property
+    def loc_idxs(self):
+        return self._split_loci()[0]
+
+    @cached_property
+    def loc_counts(self):
+        return self._split_loci()[1]
+
+    @memoize_instance
+    def _split_loci(self):
+        freqs = self.csr_freqs_matrix.tocsc()
+        freqs.sort_indices()
+        return (raw_np.split(raw_np.asarray(freqs.indices, dtype=int),
+                             freqs.indptr[1:-1]),
+                raw_np.split(raw_np.asarray(freqs.data, dtype=float),
+                             freqs.indptr[1:-1]))
+
     @property
     def populations(self):
         return self.sampled_pops
@@ -219,9 +296,24 @@ class Sfs(object):
     @memoize_instance
     def combine_loci(self):
         # return copy with all loci combined
-        return self.from_matrix(self.freqs_matrix.sum(axis=1),
-                                self.configs, self.folded,
-                                self._length)
+        return self._from_csr(
+            scipy.sparse.csr_matrix(self.freqs_matrix.sum(axis=1)),
+            self.configs, self.folded, self._length)
+
+    def merge(self, *others):
+        """Combine with the loci of other :class:`Sfs` of the same populations.
+
+        See also :class:`SfsBuilder`, to accumulate many :class:`Sfs` \
+        one at a time.
+
+        :returns: An :class:`Sfs` with the loci of this :class:`Sfs`, \
+        followed by the loci of each of ``others``.
+        :rtype: :class:`Sfs`
+        """
+        builder = SfsBuilder(self)
+        for other in others:
+            builder.add(other)
+        return builder.build()
 
     @property
     def freqs_matrix(self):
@@ -300,7 +392,7 @@ class Sfs(object):
 
         :rtype: int
         """
-        return len(self.loc_idxs)
+        return self._n_loci
 
     @property
     def n_nonzero_entries(self):
@@ -415,23 +507,88 @@ class Sfs(object):
         :returns: A copy of the SFS, but with folded entries.
         :rtype: :class:`Sfs`
         """
-        def get_folded(config):
-            if tuple(config[:, 0]) < tuple(config[:, 1]):
-                return config[:, ::-1]
-            else:
-                return config
-
-        compressed_folded = CompressedAlleleCounts.from_iter(
-            map(get_folded, self.configs),
-            len(self.sampled_pops), sort=False)
-
-        return self.from_matrix(
-            compressed_folded.index2uniq_mat @ self.freqs_matrix,
-            ConfigList(self.sampled_pops, compressed_folded.config_array,
+        configs = raw_np.asarray(self.configs.value)
+        a, d = configs[:, :, 0], configs[:, :, 1]
+
+        # flip configs with tuple(a) < tuple(d), compared lexicographically
+        first_diff = raw_np.argmax(a != d, axis=1)
+        rows = raw_np.arange(len(configs))
+        flip = a[rows, first_diff] < d[rows, first_diff]
+        folded = raw_np.where(flip[:, raw_np.newaxis, raw_np.newaxis],
+                              configs[:, :, ::-1], configs)
+
+        folded_configs, mat = self._regroup_configs(
+            raw_np.arange(len(configs)), folded)
+        return self._from_csr(
+            mat,
+            ConfigList(self.sampled_pops, folded_configs,
                         sampled_n=self.sampled_n,
                         ascertainment_pop=self.ascertainment_pop),
             folded=True, length=self._length)
 
+    def _regroup_configs(self, config_idxs, new_configs, weights=None):
+        # merges the rows config_idxs of the frequency matrix
+        # that have the same new_configs (optionally weighting each row);
+        # returns the unique new configs (in order of first appearance)
+        # and the merged frequency matrix
+        uniq_configs, index2uniq = _unique_configs(new_configs)
+        if weights is None:
+            weights = raw_np.ones(len(config_idxs))
+        regroup = scipy.sparse.csr_matrix(
+            (weights, (index2uniq, config_idxs)),
+            shape=(len(uniq_configs), len(self.configs)))
+        return uniq_configs, regroup.dot(self.csr_freqs_matrix)
+
+    def _down_sample(self, sampled_n_dict):
+        """
+        Expected SFS after subsampling (without replacement)
+        to smaller sample sizes. Counts are fractional in general.
+
+        See also: SnpAlleleCounts.down_sample()
+        """
+        configs = raw_np.array(self.configs.value)
+        config_idxs = raw_np.arange(len(configs))
+        weights = raw_np.ones(len(configs))
+
+        sampled_pops = list(self.sampled_pops)
+        for pop, n in sampled_n_dict.items():
+            i = sampled_pops.index(pop)
+            curr_n = configs[:, i, :].sum(axis=1)
+
+            # expand each config by its possible subsamples in pop
+            new_configs, new_idxs, new_weights = [
+                [arr[curr_n <= n]] for arr in (
+                    configs, config_idxs, weights)]
+            for N in raw_np.unique(curr_n[curr_n > n]):
+                is_N = curr_n == N
+                # probability of each ancestral count in the subsample
+                probs = hypergeom_mat(N, n)[:, configs[is_N, i, 0]].T
+                rows, new_anc = raw_np.nonzero(probs)
+
+                expanded = configs[is_N][rows]
+                expanded[:, i, 0] = new_anc
+                expanded[:, i, 1] = n - new_anc
+                new_configs.append(expanded)
+                new_idxs.append(config_idxs[is_N][rows])
+                new_weights.append(weights[is_N][rows] * probs[rows, new_anc])
+            configs, config_idxs, weights = [
+                raw_np.concatenate(arr) for arr in (
+                    new_configs, new_idxs, new_weights)]
+
+        # keep only configs that are still polymorphic
+        asc_only = configs[:, self.ascertainment_pop, :]
+        is_poly = (asc_only.sum(axis=1) != 0).all(axis=1)
+
+        new_configs, mat = self._regroup_configs(
+            config_idxs[is_poly], configs[is_poly], weights[is_poly])
+        ret = self._from_csr(
+            mat, ConfigList(self.sampled_pops, new_configs,
+                            ascertainment_pop=self.ascertainment_pop),
+            False, self._length)
+        if self.folded:
+            ret = ret.fold()
+        return ret
+
     def _copy(self, sampled_n=None):
         """
         See also: ConfigList._copy()
@@ -448,8 +605,8 @@ class Sfs(object):
     def _integrate_sfs(self, weights, vector=False, locus=None):
         if vector:
             assert locus is None
-            return np.array([self._integrate_sfs(weights, locus=loc)
-                             for loc in range(self.n_loci)])
+            # one sparse matrix-vector product over all loci
+            return _sparse_dot(self.csr_freqs_matrix.T, weights)
         if locus is None:
             idxs, counts = slice(None), self._total_freqs
         else:
@@ -491,21 +648,20 @@ class Sfs(object):
         asc_only = self.configs[:, old_pop_idx[ascertained], :]
         asc_is_poly = (asc_only.sum(axis=1) != 0).all(axis=1)
         asc_is_poly = np.arange(len(asc_is_poly))[asc_is_poly]
-        sub_sfs = self._subset_configs(asc_is_poly)
 
         # get the new configs
-        new_configs = CompressedAlleleCounts.from_iter(
-            sub_sfs.configs[:, old_pop_idx, :],
-            len(populations), sort=False)
+        new_configs, mat = self._regroup_configs(
+            asc_is_poly,
+            raw_np.asarray(self.configs.value)[asc_is_poly][:, old_pop_idx, :])
 
-        return self.from_matrix(
-            new_configs.index2uniq_mat @ sub_sfs.freqs_matrix,
-            ConfigList(populations, new_configs.config_array,
+        return self._from_csr(
+            mat,
+            ConfigList(populations, new_configs,
                         ascertainment_pop=ascertained),
             self.folded, self._length)
 
     def _subset_configs(self, idxs):
-        return self.from_matrix(
+        return self._from_csr(
             self.csr_freqs_matrix[idxs, :],
             _ConfigList_Subset(self.configs, idxs),
             self.folded, self._length)
@@ -560,6 +716,106 @@ class Sfs(object):
         return np.array(ret)
 
 
+class SfsBuilder(object):
+    """
+    Accumulates an :class:`Sfs` from batches of loci, e.g. \
+    new chromosomes or datasets of the same populations.
+
+    Each call to :meth:`SfsBuilder.add` takes time proportional \
+    to the size of the added :class:`Sfs`, as the loci already added \
+    are left untouched. Use :meth:`SfsBuilder.build` to get the \
+    combined :class:`Sfs`; this merges the configs of the added \
+    loci in one vectorized pass.
+
+    :param Sfs,None sfs: Initial loci (if any). \
+    Otherwise, the populations are set by the first added :class:`Sfs`.
+    """
+    def __init__(self, sfs=None):
+        self.sampled_pops = None
+        self.n_loci = 0
+        # the configs of each added Sfs, and the (local) config index
+        # of each nonzero entry of its loci; merged by build()
+        self._config_arrays = []
+        self._data, self._indices, self._indptr = [], [], [[0]]
+        self._nnz = 0
+        self._length = 0
+        if sfs is not None:
+            self.add(sfs)
+
+    def add(self, sfs):
+        """Append the loci of an :class:`Sfs`.
+
+        Its populations must be the same as the previously added loci, \
+        and it must be folded if and only if they are folded.
+
+        :param Sfs sfs: The loci to add
+        """
+        if self.sampled_pops is None:
+            self.sampled_pops = tuple(sfs.sampled_pops)
+            self.ascertainment_pop = np.array(sfs.ascertainment_pop)
+            self.sampled_n = np.array(sfs.sampled_n)
+            self.folded = sfs.folded
+        elif tuple(sfs.sampled_pops) != self.sampled_pops:
+            if sorted(sfs.sampled_pops) != sorted(self.sampled_pops):
+                raise ValueError("Cannot add Sfs with populations {}"
+                                 " to Sfs with populations {}".format(
+                                     sfs.sampled_pops, self.sampled_pops))
+            sfs = sfs.subset_populations(self.sampled_pops)
+
+        if sfs.folded != self.folded:
+            raise ValueError("Cannot add folded and unfolded Sfs")
+        if np.any(np.array(sfs.ascertainment_pop) != self.ascertainment_pop):
+            raise ValueError("Cannot add Sfs with different ascertainment")
+        self.sampled_n = raw_np.maximum(self.sampled_n, sfs.sampled_n)
+
+        # append the loci as columns
+        mat = scipy.sparse.csc_matrix(sfs.freqs_matrix)
+        self._config_arrays.append(
+            raw_np.asarray(sfs.configs.value, dtype=int))
+        self._data.append(mat.data)
+        self._indices.append(mat.indices)
+        self._indptr.append(mat.indptr[1:] + self._nnz)
+        self._nnz += mat.nnz
+        self.n_loci += mat.shape[1]
+
+        if self._length is None or sfs.length is None:
+            self._length = None
+        else:
+            self._length += sfs.length
+
+    def build(self):
+        """
+        :returns: The combined :class:`Sfs`, with the loci in the order they were added
+        :rtype: :class:`Sfs`
+        """
+        if self.sampled_pops is None:
+            raise ValueError("No Sfs added")
+        # merge the configs, and keep the merged configs and indices,
+        # so later calls only merge the newly added ones
+        configs, old2new = _merge_config_arrays(self._config_arrays)
+        self._config_arrays = [configs]
+        self._indices = [raw_np.concatenate(
+            [idx[indices] for idx, indices in zip(old2new, self._indices)])]
+        self._data = [raw_np.concatenate(self._data)]
+        self._indptr = [raw_np.concatenate(self._indptr)]
+
+        freqs_matrix = scipy.sparse.csc_matrix(
+            (self._data[0], self._indices[0], self._indptr[0]),
+            shape=(len(configs), self.n_loci))
+        configs = ConfigList(self.sampled_pops, configs,
+                             sampled_n=self.sampled_n,
+                             ascertainment_pop=self.ascertainment_pop)
+        return Sfs._from_csr(freqs_matrix.tocsr(), configs,
+                             self.folded, self._length)
+
+
+@primitive
+def _sparse_dot(mat, vec):
+    return mat.dot(vec)
+defvjp(_sparse_dot, None,
+       lambda ans, mat, vec: lambda g: _sparse_dot(mat.T, g))
+
+
 def _csr_freq_matrix_from_counters(idxs_by_loc, cnts_by_loc,
                                    n_configs):
     data = []
@@ -1,6 +1,6 @@
 import os
 import itertools as it
-from collections import defaultdict, Counter
+import concurrent.futures
 import json
 import re
 import gzip
@@ -12,7 +12,9 @@ from .configurations import ConfigList
 from .sfs import Sfs
 from ..util import memoize_instance
 from .compressed_counts import (
-    CompressedAlleleCounts, _CompressedHashedCounts, _CompressedList)
+    CompressedAlleleCounts, _CompressedHashedCounts, _CompressedList,
+    _BlockedConfigCounts, _merge_config_arrays, _unique_configs)
+from .binary import _is_binary_file, _dump_arrays, _load_arrays
 
 
 logger = logging.getLogger(__name__)
@@ -53,6 +55,400 @@ def snp_allele_counts(chrom_ids, positions, populations,
                            len(chrom_ids), 0)
 
 
+def _read_bed(bed_file):
+    if bed_file.endswith(".gz"):
+        bed = gzip.open(bed_file, "rt")
+    else:
+        bed = open(bed_file)
+    regions = []
+    with bed:
+        for line in bed:
+            line = line.split()
+            regions.append((line[0], int(line[1]), int(line[2])))
+    return regions
+
+
+class _GenomicIndex(object):
+    """
+    Index of SNPs sorted by position within each chromosome.
+
+    order[offsets[c]:offsets[c+1]] are the indices of the SNPs on
+    chromosome c (the code of the chromosome in chrom_ids.uniq_values),
+    sorted by position. Regions are 0-based and half-open as in BED files,
+    so a SNP at (1-based) position p is in [start, end) iff start < p <= end.
+    """
+    def __init__(self, chrom_ids, positions):
+        codes = chrom_ids._get_array()
+        self.order = np.lexsort((positions, codes))
+        self.is_sorted = np.all(self.order == np.arange(len(self.order)))
+        self.sorted_positions = positions[self.order]
+        self.offsets = np.append(0, np.cumsum(np.bincount(
+            codes, minlength=len(chrom_ids.uniq_values))))
+
+        self.chrom2code = dict(chrom_ids.value2uniq)
+        # so that chromosome names (e.g. from BED files) match integer ids
+        for chrom, code in chrom_ids.value2uniq.items():
+            self.chrom2code.setdefault(str(chrom), code)
+
+    def sorted_range(self, chrom, starts=None, ends=None):
+        # range of each region in the sorted SNPs
+        code = self.chrom2code.get(chrom, self.chrom2code.get(str(chrom)))
+        if code is None:
+            lo = hi = 0
+        else:
+            lo, hi = self.offsets[code], self.offsets[code+1]
+
+        positions = self.sorted_positions[lo:hi]
+        if starts is None:
+            i = lo
+        else:
+            i = lo + np.searchsorted(positions, starts, side="right")
+        if ends is None:
+            j = hi
+        else:
+            j = lo + np.searchsorted(positions, ends, side="right")
+        return i, j
+
+    def mask(self, regions):
+        # boolean mask of the SNPs in any of the regions
+        chrom_regions = {}
+        for chrom, start, end in regions:
+            chrom_regions.setdefault(chrom, []).append((start, end))
+
+        in_regions = np.zeros(len(self.order)+1, dtype=int)
+        for chrom, intervals in chrom_regions.items():
+            i, j = self.sorted_range(chrom, *np.array(intervals).T)
+            np.add.at(in_regions, i, 1)
+            np.add.at(in_regions, j, -1)
+
+        ret = np.zeros(len(self.order), dtype=bool)
+        ret[self.order] = np.cumsum(in_regions[:-1]) > 0
+        return ret
+
+
+def _vcf_populations(ind2pop, ancestral_alleles):
+    return sorted(p for p in set(ind2pop.values())
+                  if p != ancestral_alleles)
+
+
+def _gt_allele_counts(vcf_line, sample_pops, n_pops):
+    """
+    Counts of allele 0 and 1 in each population at a biallelic record,
+    from the text of the VCF line.
+
+    Rather than looping over samples, this finds the GT subfield of every
+    sample column at once, and counts its 0 and 1 characters with bincount.
+
+    Returns an array with shape (n_pops, 2), or None if the record
+    has no GT field.
+    """
+    line = np.frombuffer(vcf_line.encode(), dtype=np.uint8)
+    is_tab = line == ord("\t")
+    tabs = np.flatnonzero(is_tab)
+    if len(tabs) < 9:
+        # no sample columns
+        return np.zeros((n_pops, 2), dtype=int)
+
+    # the position of GT among the colon-separated FORMAT keys
+    format_keys = line[tabs[7]+1:tabs[8]].tobytes().split(b":")
+    try:
+        gt_idx = format_keys.index(b"GT")
+    except ValueError:
+        return None
+
+    # the sample columns start after the 9th tab
+    sample_of_byte = np.cumsum(is_tab) - 9
+    # keep the bytes of the gt_idx-th subfield of each sample column
+    n_colons = np.cumsum(line == ord(":"))
+    colons_before_sample = n_colons[tabs[8:]]
+    in_gt = sample_of_byte >= 0
+    in_gt[in_gt] = (n_colons[in_gt] - colons_before_sample[
+        sample_of_byte[in_gt]] == gt_idx)
+
+    # "0" and "1" map to 0 and 1, all other characters to larger values
+    allele = line - np.uint8(ord("0"))
+    counted = in_gt & (allele <= 1)
+    return np.bincount(
+        2 * sample_pops[sample_of_byte[counted]] + allele[counted],
+        minlength=2 * n_pops).reshape((n_pops, 2))
+
+
+def _vcf_shards(vcf_file, bed_file, processes):
+    # the regions to read (from the BED, or else the whole VCF)
+    # as a list of contiguous shards, one per job if processes > 1;
+    # also returns the length of the regions (None if no BED)
+    if bed_file:
+        regions = _read_bed(bed_file)
+        length = sum(end - start for _, start, end in regions)
+    else:
+        length = None
+        logger.warn("No BED provided, will need to specify length"
+                    " manually with mutation rate")
+        regions = [(None, None, None)]
+
+    if processes is not None and processes > 1:
+        if vcf_file == "-":
+            raise ValueError("Cannot read stdin with multiple processes")
+        if not bed_file:
+            # the contigs in the order of the file (which can differ
+            # from the header): an index requires each contig to be
+            # contiguous, and numbers the contigs in order of the file
+            with pysam.VariantFile(vcf_file) as bcf_in:
+                if bcf_in.index is None:
+                    raise ValueError(
+                        "Reading with multiple processes requires"
+                        " an indexed VCF")
+                regions = [(contig, None, None)
+                           for contig in bcf_in.index]
+        # contiguous shards, so that SNPs stay in the same order
+        shards = [[regions[i] for i in shard_idxs]
+                  for shard_idxs in np.array_split(
+                          np.arange(len(regions)),
+                          min(len(regions), 4 * processes))]
+    else:
+        shards = [regions]
+    return shards, length
+
+
+def _map_vcf_shards(read_shard, shards, processes, *args):
+    # read_shard(shard, *args) for each shard, in subprocesses
+    # if processes > 1
+    if processes is not None and processes > 1:
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            return list(executor.map(
+                read_shard, shards, *[it.repeat(arg) for arg in args]))
+    else:
+        return [read_shard(shard, *args) for shard in shards]
+
+
+def _open_vcf(vcf_file, ind2pop, ancestral_alleles):
+    bcf_in = pysam.VariantFile(vcf_file)
+
+    # subset samples for faster VCF parsing
+    bcf_in.subset_samples(list(ind2pop.keys()))
+    samples = list(bcf_in.header.samples)
+    assert set(samples) == set(ind2pop.keys())
+
+    # extract populations, samples;
+    # the outgroup (if any) comes after the sampled populations
+    sampled_pops = _vcf_populations(ind2pop, ancestral_alleles)
+    pops = sampled_pops + sorted(set(ind2pop.values()) - set(sampled_pops))
+    sample_pops = np.array([pops.index(ind2pop[ind]) for ind in samples],
+                           dtype=int)
+    return bcf_in, sampled_pops, sample_pops
+
+
+def _read_vcf_regions(regions, vcf_file, ind2pop,
+                      ancestral_alleles, info_aa_field):
+    # reads the (contig, start, end) regions of the VCF,
+    # in a subprocess if SnpAlleleCounts.read_vcf(processes > 1)
+    bcf_in, sampled_pops, sample_pops = _open_vcf(
+        vcf_file, ind2pop, ancestral_alleles)
+
+    # objects to store chrom, pos, configs
+    chrom_list = _CompressedList()
+    pos_list = []
+    compressed_hashed = _CompressedHashedCounts(len(sampled_pops))
+    excluded = []
+
+    for contig, start, end in regions:
+        for chrom, pos, config in _read_vcf_records(
+                bcf_in.fetch(contig, start, end), excluded,
+                ancestral_alleles, sample_pops, len(sampled_pops),
+                info_aa_field):
+            chrom_list.append(chrom)
+            pos_list.append(pos)
+            compressed_hashed.append(config)
+    bcf_in.close()
+
+    return (chrom_list, pos_list, compressed_hashed.config_array(),
+            compressed_hashed.index2uniq(), len(excluded))
+
+
+def _max_fine_blocks(n_blocks):
+    # number of blocks to accumulate before merging them pairwise,
+    # when streaming an SFS with n_blocks blocks of equal numbers of SNPs
+    return max(2**10, 16 * n_blocks)
+
+
+def _read_vcf_sfs_regions(regions, vcf_file, ind2pop,
+                          ancestral_alleles, info_aa_field,
+                          n_blocks, block_bp):
+    # reads the regions of the VCF into counts of each config in each
+    # block, without storing the SNPs. If n_blocks is None, the blocks
+    # are keyed by (chrom, pos // block_bp) or (chrom, 0) if block_bp
+    # is None. Otherwise the blocks are consecutive runs of snps_per_block
+    # SNPs, with snps_per_block doubling whenever there are too many blocks
+    bcf_in, sampled_pops, sample_pops = _open_vcf(
+        vcf_file, ind2pop, ancestral_alleles)
+
+    counts = _BlockedConfigCounts(len(sampled_pops))
+    excluded = []
+    block_keys = {}
+    n_snps = 0
+    snps_per_block = 1
+
+    for contig, start, end in regions:
+        for chrom, pos, config in _read_vcf_records(
+                bcf_in.fetch(contig, start, end), excluded,
+                ancestral_alleles, sample_pops, len(sampled_pops),
+                info_aa_field):
+            if n_blocks is None:
+                if block_bp is None:
+                    key = (chrom, 0)
+                else:
+                    key = (chrom, pos // block_bp)
+                block = block_keys.setdefault(key, len(block_keys))
+            else:
+                block = n_snps // snps_per_block
+                if block >= _max_fine_blocks(n_blocks):
+                    counts.merge_blocks(np.arange(counts.n_blocks) // 2)
+                    snps_per_block *= 2
+                    block = n_snps // snps_per_block
+            counts.append(block, config)
+            n_snps += 1
+    bcf_in.close()
+
+    if n_blocks is None:
+        blocks = sorted(block_keys, key=block_keys.get)
+    else:
+        # the number of SNPs in each block
+        blocks = np.diff(np.minimum(
+            np.arange(counts.n_blocks + 1) * snps_per_block, n_snps))
+    return (blocks, counts.config_array(), counts.counts(),
+            n_snps, len(excluded))
+
+
+def _read_vcf_records(bcf_in_fetch, excluded, ancestral_alleles,
+                      sample_pops, n_sampled_pops, info_aa_field):
+    # yields the chrom, pos, config of each biallelic SNP,
+    # appending the (chrom, pos) of SNPs without ancestral allele to excluded
+    n_pops = np.max(sample_pops) + 1
+    n_read = 0
+    for rec in bcf_in_fetch:
+        if len(rec.alleles) != 2:
+            continue
+
+        pop_allele_counts = _gt_allele_counts(
+            str(rec), sample_pops, n_pops)
+        if pop_allele_counts is None:
+            # no genotypes
+            continue
+
+        if ancestral_alleles is True:
+            try:
+                aa = rec.info[info_aa_field]
+            except KeyError:
+                excluded.append((rec.chrom, rec.pos))
+                continue
+            else:
+                try:
+                    aa = rec.alleles.index(aa)
+                except ValueError:
+                    excluded.append((rec.chrom, rec.pos))
+                    continue
+        elif ancestral_alleles:
+            outgroup_counts = pop_allele_counts[-1]
+            if np.sum(outgroup_counts > 0) != 1:
+                excluded.append((rec.chrom, rec.pos))
+                continue
+            aa = int(outgroup_counts[1] > 0)
+        else:
+            aa = 0
+
+        config = pop_allele_counts[:n_sampled_pops]
+
+        if aa == 1:
+            config = config[:, ::-1]
+
+        yield rec.chrom, rec.pos, config
+
+        n_read += 1
+        if n_read % 10000 == 0:
+            logger.info("Read vcf up to CHR {}, POS {}".format(
+                rec.chrom, rec.pos))
+
+
+def read_vcf_sfs(vcf_file, ind2pop, n_blocks=None, block_bp=None,
+                 bed_file=None, ancestral_alleles=True,
+                 info_aa_field="AA", processes=None):
+    """Read the SFS of a VCF file directly, without storing \
+    the allele counts of each SNP.
+
+    This gives the same SFS as ``SnpAlleleCounts.read_vcf(...).extract_sfs(...)``, \
+    but uses memory proportional to the number of \
+    unique configs and blocks, rather than the number of SNPs.
+
+    :param int,None n_blocks: Number of blocks to split the SFS into, \
+    for jackknifing and bootstrapping. As the total number of SNPs \
+    is not known in advance, the blocks only have nearly the same \
+    number of SNPs, so their boundaries may differ slightly from \
+    :meth:`SnpAlleleCounts.extract_sfs`. If None, each chromosome is a block, \
+    unless block_bp is given.
+    :param int,None block_bp: If not None, split the SFS into blocks \
+    of this many bases on each chromosome, as in \
+    :meth:`SnpAlleleCounts.extract_sfs`. Cannot be used with n_blocks.
+
+    The other arguments are as in :meth:`SnpAlleleCounts.read_vcf`.
+
+    :rtype: :class:`Sfs`
+    """
+    if n_blocks is not None and block_bp is not None:
+        raise ValueError("Cannot specify both n_blocks and block_bp")
+
+    shards, length = _vcf_shards(vcf_file, bed_file, processes)
+    shards = _map_vcf_shards(
+        _read_vcf_sfs_regions, shards, processes, vcf_file, ind2pop,
+        ancestral_alleles, info_aa_field, n_blocks, block_bp)
+    blocks, config_arrays, shard_counts, n_snps, n_excluded = zip(*shards)
+
+    # map the blocks of each shard to the final blocks
+    if n_blocks is None:
+        key2block = {}
+        shard_blocks = [
+            np.array([key2block.setdefault(key, len(key2block))
+                      for key in keys], dtype=int)
+            for keys in blocks]
+    else:
+        # as in SnpAlleleCounts._chunk_data(), using the index
+        # of the first SNP of each block
+        block_sizes = np.concatenate(blocks)
+        chunk_len = np.sum(block_sizes) / float(n_blocks)
+        fine2block = np.floor(
+            (np.cumsum(block_sizes) - block_sizes) / chunk_len).astype(int)
+        shard_blocks = np.split(fine2block, np.cumsum(
+            [len(b) for b in blocks])[:-1])
+
+    sampled_pops = _vcf_populations(ind2pop, ancestral_alleles)
+    counts = _BlockedConfigCounts(len(sampled_pops))
+    for args in zip(config_arrays, shard_counts, shard_blocks):
+        counts.add_counts(*args)
+    config_array = counts.config_array()
+    counts = counts.counts().astype(float)
+
+    # keep polymorphic configs, and blocks containing them
+    is_poly = (config_array.sum(axis=1) != 0).all(axis=1)
+    if not np.any(is_poly):
+        raise ValueError("No polymorphic SNPs read")
+    counts = counts[is_poly, :]
+    counts = counts[:, np.asarray(counts.sum(axis=0)).reshape(-1) > 0]
+    compressed_counts = CompressedAlleleCounts(
+        config_array[is_poly], np.arange(np.sum(is_poly)))
+    counts = counts[np.argsort(compressed_counts.index2uniq), :]
+
+    if length:
+        n_excluded = sum(n_excluded)
+        length = length * (1 - n_excluded / (sum(n_snps) + n_excluded))
+    ret = Sfs._from_csr(
+        counts,
+        ConfigList(sampled_pops, compressed_counts.config_array,
+                   ascertainment_pop=np.ones(len(sampled_pops), dtype=bool)),
+        folded=False, length=length)
+    if not ancestral_alleles:
+        ret = ret.fold()
+    return ret
+
+
 class SnpAlleleCounts(object):
     """
     The allele counts for a list of SNPs.
@@ -65,7 +461,7 @@ class SnpAlleleCounts(object):
     @classmethod
     def read_vcf(cls, vcf_file, ind2pop,
                  bed_file=None, ancestral_alleles=True,
-                 info_aa_field="AA"):
+                 info_aa_field="AA", processes=None):
         """Read in a VCF file and return the allele counts at biallelic SNPs.
 
         :param str vcf_file: VCF file to read in. "-" reads from stdin.
@@ -87,126 +483,37 @@ class SnpAlleleCounts(object):
         consensus are skipped.
         :param str info_aa_field: The INFO field to read Ancestral Allele from. \
         Default is "AA". Only has effect if ``ancestral_alleles=True``.
+        :param int,None processes: If greater than 1, read the VCF in this \
+        many subprocesses, splitting the BED regions (or the contigs in the \
+        VCF header, if no BED is provided) between them. \
+        Requires an indexed VCF file.
 
         :rtype: :class:`SnpAlleleCounts`
         """
-        bcf_in = pysam.VariantFile(vcf_file)
-
-        # subset samples for faster VCF parsing
-        bcf_in.subset_samples(list(ind2pop.keys()))
-        samples = list(bcf_in.header.samples)
-        assert set(samples) == set(ind2pop.keys())
-
-        # extract populations, samples
-        pop2idxs = defaultdict(list)
-        for ind, pop in ind2pop.items():
-            pop2idxs[pop].append(samples.index(ind))
-        sampled_pops = sorted(
-            p for p in pop2idxs.keys() if p != ancestral_alleles)
-
-        # objects to store chrom, pos, configs
-        chrom_list = _CompressedList()
-        pos_list = []
-        compressed_hashed = _CompressedHashedCounts(len(sampled_pops))
-        excluded = []
-
-        # pre-allocate objects for temporary configs
-        pop_allele_counts = {pop: Counter() for pop in pop2idxs.keys()}
-        config = np.zeros((len(sampled_pops), 2), dtype=int)
-
-        if bed_file:
-            def open_bed():
-                if bed_file.endswith(".gz"):
-                    return gzip.open(bed_file, "rt")
-                else:
-                    return open(bed_file)
-            length = 0
-            with open_bed() as bed:
-                for line in bed:
-                    line = line.split()
-                    contig = line[0]
-                    start, end = map(int, line[1:3])
-                    length += (end - start)
-                    fetcher = bcf_in.fetch(
-                        contig, start, end)
-                    cls._read_vcf_helper(
-                        fetcher, chrom_list, pos_list,
-                        compressed_hashed, excluded,
-                        ancestral_alleles, pop2idxs,
-                        sampled_pops, pop_allele_counts, config,
-                        info_aa_field)
-        else:
-            length = None
-            logger.warn("No BED provided, will need to specify length"
-                        " manually with mutation rate")
-            fetcher = bcf_in.fetch()
-            cls._read_vcf_helper(
-                fetcher, chrom_list, pos_list, compressed_hashed,
-                excluded, ancestral_alleles, pop2idxs, sampled_pops,
-                pop_allele_counts, config, info_aa_field)
-
-        if len(compressed_hashed) == 0:
+        shards, length = _vcf_shards(vcf_file, bed_file, processes)
+        shards = _map_vcf_shards(
+            _read_vcf_regions, shards, processes, vcf_file, ind2pop,
+            ancestral_alleles, info_aa_field)
+
+        chrom_lists, pos_lists, config_arrays, index2uniqs, n_excluded = zip(
+            *shards)
+        chrom_list = _CompressedList._concatenate(chrom_lists)
+        pos_list = np.concatenate([np.array(pos, dtype=int)
+                                   for pos in pos_lists])
+        config_array, old2new_uniq = _merge_config_arrays(config_arrays)
+        compressed_counts = CompressedAlleleCounts(
+            config_array, np.concatenate([
+                old2new[np.array(index2uniq, dtype=int)]
+                for old2new, index2uniq in zip(old2new_uniq, index2uniqs)]))
+
+        if len(compressed_counts) == 0:
             logger.warn("No valid SNPs read! Try setting "
                         "ancestral_alleles=False.")
 
-        return cls(chrom_list, pos_list,
-                   compressed_hashed.compressed_allele_counts(),
-                   sampled_pops, not ancestral_alleles, [], length,
-                   len(chrom_list), len(excluded))
-
-    @classmethod
-    def _read_vcf_helper(
-            cls, bcf_in_fetch, chrom, pos, compressed_hashed, excluded,
-            ancestral_alleles, pop2idxs, sampled_pops,
-            pop_allele_counts, config, info_aa_field):
-        for rec in bcf_in_fetch:
-            if len(rec.alleles) != 2:
-                continue
-
-            for pop, inds in pop2idxs.items():
-                pop_allele_counts[pop].clear()
-                for i in inds:
-                    for a in rec.samples[i].allele_indices:
-                        if a is not None:
-                            pop_allele_counts[pop][a] += 1
-
-            if ancestral_alleles is True:
-                try:
-                    aa = rec.info[info_aa_field]
-                except KeyError:
-                    excluded.append((rec.chrom, rec.pos))
-                    continue
-                else:
-                    try:
-                        aa = rec.alleles.index(aa)
-                    except ValueError:
-                        excluded.append((rec.chrom, rec.pos))
-                        continue
-            elif ancestral_alleles:
-                outgroup_counts = pop_allele_counts[ancestral_alleles]
-                if len(outgroup_counts) != 1:
-                    excluded.append((rec.chrom, rec.pos))
-                    continue
-                aa, = outgroup_counts.keys()
-            else:
-                aa = 0
-
-            config *= 0
-            for pop_idx, pop in enumerate(sampled_pops):
-                for a, n in pop_allele_counts[pop].items():
-                    config[pop_idx, a] = n
-
-            if aa == 1:
-                config = config[:, ::-1]
-
-            compressed_hashed.append(config)
-
-            chrom.append(rec.chrom)
-            pos.append(rec.pos)
-
-            if len(pos) % 10000 == 0:
-                logger.info("Read vcf up to CHR {}, POS {}".format(
-                    chrom[-1], pos[-1]))
+        return cls(chrom_list, pos_list, compressed_counts,
+                   _vcf_populations(ind2pop, ancestral_alleles),
+                   not ancestral_alleles, [], length,
+                   len(chrom_list), sum(n_excluded))
 
     @classmethod
     def concatenate(cls, to_concatenate):
@@ -221,12 +528,10 @@ class SnpAlleleCounts(object):
         nonascertained = list(first.non_ascertained_pops)
         to_concatenate = it.chain([first], to_concatenate)
 
-        #chrom_ids = []
-        chrom_ids = _CompressedList()
+        chrom_lists = []
         positions = []
-        index2uniq = []
-
-        compressed_hashes = _CompressedHashedCounts(len(populations))
+        config_arrays = []
+        index2uniqs = []
 
         use_folded_sfs = False
         length = 0
@@ -241,19 +546,16 @@ class SnpAlleleCounts(object):
                 raise ValueError(
                     "Datasets must have same populations with same"
                     " ascertainment to concatenate")
-            old2new_uniq = []
-            for config in snp_cnts.compressed_counts.config_array:
-                compressed_hashes.append(config)
-                old2new_uniq.append(compressed_hashes.index2uniq(-1))
 
             assert len(snp_cnts.chrom_ids) == len(snp_cnts.compressed_counts.index2uniq)
             assert len(snp_cnts.chrom_ids) == len(snp_cnts.positions)
-            for chrom, pos, old_uniq in zip(snp_cnts.chrom_ids,
-                                            snp_cnts.positions,
-                                            snp_cnts.compressed_counts.index2uniq):
-                chrom_ids.append(chrom)
-                positions.append(pos)
-                index2uniq.append(old2new_uniq[old_uniq])
+            chroms = snp_cnts.chrom_ids
+            if not isinstance(chroms, _CompressedList):
+                chroms = _CompressedList(chroms)
+            chrom_lists.append(chroms)
+            positions.append(np.asarray(snp_cnts.positions))
+            config_arrays.append(snp_cnts.compressed_counts.config_array)
+            index2uniqs.append(snp_cnts.compressed_counts.index2uniq)
 
             try:
                 length += snp_cnts.length
@@ -263,15 +565,33 @@ class SnpAlleleCounts(object):
             n_read_snps += snp_cnts.n_read_snps
             n_excluded_snps += snp_cnts.n_excluded_snps
 
-            for k, v in Counter(snp_cnts.chrom_ids).items():
+            for k, v in zip(chroms.uniq_values, np.bincount(
+                    chroms._get_array(), minlength=len(chroms.uniq_values))):
                 logger.info("Added {} SNPs from Chromosome {}".format(v, k))
 
-        # make sure the positions are sorted
-        chrom_ids, positions, index2uniq = zip(*sorted(zip(
-            chrom_ids, positions, index2uniq)))
-
-        compressed_counts = CompressedAlleleCounts(
-            compressed_hashes.config_array(), index2uniq)
+        # union of the unique configs
+        config_array, old2new_uniq = _merge_config_arrays(config_arrays)
+        index2uniq = np.concatenate([
+            old2new[old_index2uniq]
+            for old2new, old_index2uniq in zip(old2new_uniq, index2uniqs)])
+
+        chrom_ids = _CompressedList._concatenate(chrom_lists)
+        positions = np.concatenate(positions)
+
+        # sort the SNPs by chromosome (in order of the chromosome names),
+        # then by position, with one lexsort of the concatenated SNPs
+        chrom_rank = np.empty(len(chrom_ids.uniq_values), dtype=int)
+        chrom_rank[sorted(range(len(chrom_rank)),
+                          key=lambda i: chrom_ids.uniq_values[i])] = np.arange(
+                              len(chrom_rank))
+        order = np.lexsort((positions,
+                            chrom_rank[chrom_ids._get_array()]))
+        chrom_ids = _CompressedList._from_index2uniq(
+            chrom_ids.uniq_values, chrom_ids._get_array()[order])
+        positions = positions[order]
+        index2uniq = index2uniq[order]
+
+        compressed_counts = CompressedAlleleCounts(config_array, index2uniq)
         ret = cls(chrom_ids, positions, compressed_counts, populations,
                   use_folded_sfs=use_folded_sfs,
                   non_ascertained_pops=nonascertained,
@@ -286,9 +606,14 @@ class SnpAlleleCounts(object):
         """Load :class:`SnpAlleleCounts` created \
         from :meth:`SnpAlleleCounts.dump` or ``python -m momi.read_vcf ...``
 
-        :param str,file f: file object or file name to read in
+        :param str,file f: file object or file name to read in. \
+        If the name ends with ".momi", it is read as a binary file \
+        (see :meth:`SnpAlleleCounts.dump`), whose arrays are memory-mapped.
         :rtype: :class:`SnpAlleleCounts`
         """
+        if _is_binary_file(f):
+            return cls._load_binary(f)
+
         if isinstance(f, str):
             if f.endswith(".gz"):
                 with gzip.open(f, "rt") as gf:
@@ -377,12 +702,28 @@ class SnpAlleleCounts(object):
         return cls(chrom_ids, positions, compressed_counts,
                    **items)
 
+    @classmethod
+    def _load_binary(cls, fname):
+        arrays, info = _load_arrays(fname, "SnpAlleleCounts")
+        chrom_ids = _CompressedList._from_index2uniq(
+            info.pop("chroms"), arrays["chrom_index2uniq"])
+        compressed_counts = CompressedAlleleCounts(
+            arrays["configs"], arrays["config_index2uniq"], sort=False)
+        return cls(chrom_ids, arrays["positions"], compressed_counts,
+                   **info)
+
     def dump(self, f):
         """Write data in JSON format.
 
         :param str,file f: filename or file object. \
-        If a filename, the resulting file is gzipped.
+        If the name ends with ".gz", the resulting file is gzipped. \
+        If it ends with ".momi", a binary file is written instead, \
+        which is much faster to read and write, \
+        and whose arrays are memory-mapped by :meth:`SnpAlleleCounts.load`.
         """
+        if _is_binary_file(f):
+            return self._dump_binary(f)
+
         if isinstance(f, str):
             if f.endswith(".gz"):
                 with gzip.open(f, "wt") as gf:
@@ -429,6 +770,26 @@ class SnpAlleleCounts(object):
         print("\t]", file=f)
         print("}", file=f)
 
+    def _dump_binary(self, fname):
+        chrom_ids = self.chrom_ids
+        if not isinstance(chrom_ids, _CompressedList):
+            chrom_ids = _CompressedList(chrom_ids)
+        _dump_arrays(
+            fname, "SnpAlleleCounts",
+            {"configs": np.asarray(self.compressed_counts.config_array,
+                                   dtype=int),
+             "config_index2uniq": self.compressed_counts.index2uniq,
+             "chrom_index2uniq": chrom_ids._get_array(),
+             "positions": self.positions},
+            chroms=[c.item() if isinstance(c, np.generic) else c
+                    for c in chrom_ids.uniq_values],
+            populations=list(self.populations),
+            non_ascertained_pops=list(self.non_ascertained_pops),
+            use_folded_sfs=bool(self.use_folded_sfs),
+            length=self.length,
+            n_read_snps=int(self.n_read_snps),
+            n_excluded_snps=int(self.n_excluded_snps))
+
     def __init__(self, chrom_ids, positions,
                  compressed_counts, populations,
                  use_folded_sfs, non_ascertained_pops, length,
@@ -439,7 +800,7 @@ class SnpAlleleCounts(object):
                 "chrom_ids, positions, allele_counts should have same length")
 
         self.chrom_ids = chrom_ids
-        self.positions = np.array(positions)
+        self.positions = np.asarray(positions)
         self.compressed_counts = compressed_counts
         self.populations = populations
         self.non_ascertained_pops = non_ascertained_pops
@@ -462,6 +823,88 @@ class SnpAlleleCounts(object):
         except AttributeError:
             return False
 
+    @cached_property
+    def _genomic_index(self):
+        return _GenomicIndex(self.chrom_ids, self.positions)
+
+    def _view(self, idxs, chrom_ids=None, length=None):
+        # shares config_array (and if idxs is a slice, index2uniq)
+        # with self, unlike filter(), which compresses the configs
+        if chrom_ids is None:
+            chrom_ids = self.chrom_ids[idxs]
+        return SnpAlleleCounts(
+            chrom_ids, self.positions[idxs],
+            CompressedAlleleCounts(
+                self.compressed_counts.config_array,
+                self.compressed_counts.index2uniq[idxs], sort=False),
+            self.populations, self.use_folded_sfs,
+            self.non_ascertained_pops, length,
+            self.n_read_snps, self.n_excluded_snps)
+
+    def region(self, chrom, start=None, end=None):
+        """Get the SNPs in a genomic region, sorted by position.
+
+        Uses an index of the SNPs on each chromosome, so does not scan \
+        the whole dataset, and does not copy the allele counts.
+
+        :param chrom: The chromosome of the region
+        :param int,None start: 0-based start of the region, as in BED files. \
+        None for the start of the chromosome.
+        :param int,None end: End of the region (exclusive, 0-based), \
+        as in BED files. None for the end of the chromosome.
+
+        :returns: The SNPs in the region. Its length is unknown (None), \
+        and should be set manually if needed.
+        :rtype: :class:`SnpAlleleCounts`
+        """
+        index = self._genomic_index
+        i, j = index.sorted_range(chrom, start, end)
+        if index.is_sorted:
+            idxs = slice(i, j)
+        else:
+            idxs = index.order[i:j]
+        return self._view(idxs)
+
+    def mask_bed(self, bed_file, exclude=False):
+        """Restrict the SNPs to the regions of a BED file.
+
+        :param str bed_file: BED file (possibly gzipped)
+        :param bool exclude: If True, remove the SNPs in the BED regions \
+        instead of keeping them.
+
+        :returns: The SNPs in (or if exclude=True, outside) the BED regions. \
+        Without exclude, its length is the total length of the BED regions, \
+        as in :meth:`SnpAlleleCounts.read_vcf`; otherwise its length is \
+        unknown, and should be set manually.
+        :rtype: :class:`SnpAlleleCounts`
+        """
+        regions = _read_bed(bed_file)
+        in_regions = self._genomic_index.mask(regions)
+        if exclude:
+            return self._view(np.flatnonzero(~in_regions))
+        else:
+            return self._view(
+                np.flatnonzero(in_regions),
+                length=sum(end - start for _, start, end in regions))
+
+    @memoize_instance
+    def _block_data(self, block_bp):
+        # loci are consecutive blocks of block_bp bases on each chromosome
+        index = self._genomic_index
+        if index.is_sorted:
+            idxs = slice(None)
+        else:
+            idxs = index.order
+        codes = self.chrom_ids._get_array()[idxs]
+        blocks = np.floor(self.positions[idxs] / block_bp).astype(int)
+
+        uniq_blocks, block_index2uniq = np.unique(
+            np.array([codes, blocks]).T, axis=0, return_inverse=True)
+        block_ids = _CompressedList._from_index2uniq(
+            [(self.chrom_ids.uniq_values[c], b) for c, b in uniq_blocks],
+            block_index2uniq)
+        return self._view(idxs, chrom_ids=block_ids, length=self.length)
+
     @memoize_instance
     def _chunk_data(self, n_chunks):
         chunk_len = len(self.chrom_ids) / float(n_chunks)
@@ -474,13 +917,19 @@ class SnpAlleleCounts(object):
             self.non_ascertained_pops, self.length,
             self.n_read_snps, self.n_excluded_snps)
 
-    def extract_sfs(self, n_blocks):
+    def extract_sfs(self, n_blocks, block_bp=None):
         """Extracts SFS from data.
 
         :param int n_blocks: Number of blocks to split SFS into, for jackknifing and bootstrapping
+        :param int,None block_bp: If not None, instead split the SFS into \
+        blocks of this many bases on each chromosome, and n_blocks must be None.
         :rtype: :class:`Sfs`
         """
-        if n_blocks is None:
+        if block_bp is not None:
+            if n_blocks is not None:
+                raise ValueError("Cannot specify both n_blocks and block_bp")
+            return self._block_data(block_bp)._sfs
+        elif n_blocks is None:
             return self._sfs
         else:
             return self._chunk_data(n_blocks)._sfs
@@ -510,8 +959,7 @@ class SnpAlleleCounts(object):
 
         new_compressed_configs = CompressedAlleleCounts(
             uniq_new_configs.config_array,
-            [uniq_new_configs.index2uniq[i]
-             for i in self.compressed_counts.index2uniq],
+            uniq_new_configs.index2uniq[self.compressed_counts.index2uniq],
             sort=False)
 
         return SnpAlleleCounts(
@@ -536,27 +984,48 @@ class SnpAlleleCounts(object):
                                self.non_ascertained_pops, self.length,
                                self.n_read_snps, self.n_excluded_snps)
 
-    def down_sample(self, sampled_n_dict):
-        pops, sub_n = zip(*sampled_n_dict.items())
-        pop_idxs = [self.populations.index(p) for p in pops]
-
-        def sub_counts():
-            for config in self:
-                config = list(config)
-                for i, n in zip(pop_idxs, sub_n):
-                    curr_n = sum(config[i])
-                    if curr_n > n:
-                        old_anc, old_der = config[i]
-                        new_anc = np.random.hypergeometric(
-                            old_anc, old_der, n)
-                        new_der = n - new_anc
-                        config[i] = (new_anc, new_der)
-                yield config
+    def down_sample(self, sampled_n_dict, expected=False, n_blocks=None):
+        """Subsample the data to smaller sample sizes, without replacement.
+
+        :param dict sampled_n_dict: Maps populations to their new sample size. Populations with fewer samples at a SNP are unchanged there.
+        :param bool expected: If True, return the expected SFS of the subsample (with fractional counts), instead of randomly subsampling each SNP.
+        :param int n_blocks: If expected=True, the number of blocks of the returned SFS, as in :meth:`SnpAlleleCounts.extract_sfs`
+
+        :returns: the subsampled data, or its expected SFS if expected=True
+        :rtype: :class:`SnpAlleleCounts` or :class:`Sfs`
+        """
+        if expected:
+            return self.extract_sfs(n_blocks)._down_sample(sampled_n_dict)
+
+        config_array = self.compressed_counts.config_array
+        index2uniq = self.compressed_counts.index2uniq
+
+        # for each SNP, its old config and the new ancestral count
+        # in each subsampled population; draw SNPs of all configs at once
+        snp_keys = [index2uniq]
+        for pop, n in sampled_n_dict.items():
+            i = self.populations.index(pop)
+            anc = config_array[index2uniq, i, 0]
+            der = config_array[index2uniq, i, 1]
+            new_anc = anc.copy()
+            subsample = anc + der > n
+            new_anc[subsample] = np.random.hypergeometric(
+                anc[subsample], der[subsample], n)
+            snp_keys.append(new_anc)
+        uniq_keys, snp2key = _unique_configs(np.array(snp_keys).T)
+
+        # the new config of each unique key
+        key_configs = np.array(config_array[uniq_keys[:, 0]])
+        for j, (pop, n) in enumerate(sampled_n_dict.items()):
+            i = self.populations.index(pop)
+            subsample = key_configs[:, i, :].sum(axis=1) > n
+            key_configs[subsample, i, 0] = uniq_keys[subsample, j+1]
+            key_configs[subsample, i, 1] = n - uniq_keys[subsample, j+1]
+        new_configs, key2uniq = _unique_configs(key_configs)
 
         return SnpAlleleCounts(
             self.chrom_ids, self.positions,
-            CompressedAlleleCounts.from_iter(
-                sub_counts(), len(self.populations)),
+            CompressedAlleleCounts(new_configs, key2uniq[snp2key]),
             self.populations, self.use_folded_sfs,
             self.non_ascertained_pops, self.length,
             self.n_read_snps, self.n_excluded_snps)
@@ -595,12 +1064,13 @@ class SnpAlleleCounts(object):
     @cached_property
     def _sfs(self):
         filtered = self.filter(self.is_polymorphic)
-        idx_list = [
-            np.array([i for chrom, i in grouped_idxs])
-            for key, grouped_idxs in it.groupby(
-                    zip(filtered.chrom_ids,
-                        filtered.compressed_counts.index2uniq),
-                    key=lambda x: x[0])]
+        # a locus for each run of SNPs on the same chromosome
+        chrom_codes = filtered.chrom_ids._get_array()
+        idx_list = np.split(
+            filtered.compressed_counts.index2uniq,
+            np.flatnonzero(chrom_codes[1:] != chrom_codes[:-1]) + 1)
+        if len(chrom_codes) == 0:
+            idx_list = []
         configs = ConfigList(
             self.populations,
             filtered.compressed_counts.config_array,
@@ -4,7 +4,7 @@ from ..math_functions import symmetric_matrix, log_wishart_pdf, slogdet_pos
 from ..compute_sfs import expected_sfs_tensor_prod
 
 
-def sfs_tensor_prod(sfs, vecs):
+def sfs_tensor_prod(sfs, vecs, batch_size=-1):
     """
     Viewing the SFS as a D-tensor (where D is the number of demes), this
     returns a 1d array whose j-th entry is a summary statistic given by the
@@ -21,6 +21,11 @@ def sfs_tensor_prod(sfs, vecs):
          with n[k]+1 columns, where n[k] is the number of samples in the
          k-th deme. The row vectors vecs[k][j,:] are multiplied against
          the SFS along the k-th mode, to obtain res[j].
+    batch_size : int
+         controls the memory usage. The configs are multiplied against vecs
+         in batches of batch_size, so that at most
+         (number of rows of vecs) * batch_size products are held in memory.
+         Set batch_size=-1 to use a single batch.
 
     Returns
     -------
@@ -33,10 +38,6 @@ def sfs_tensor_prod(sfs, vecs):
     expected_sfs_tensor_prod : compute the expectation of sfs_tensor_prod for a
          randomly sampled sfs.
     """
-    res = 0.
-    #sfs = sfs.get_dict()
-    #entries, counts = list(zip(*list(sfs.items())))
-    #entries = np.array(entries, ndmin=3)
     entries = sfs.configs.value
     counts = sfs._total_freqs
 
@@ -45,10 +46,20 @@ def sfs_tensor_prod(sfs, vecs):
         raise NotImplementedError(
             "SFS-tensor-product not implemented for missing data. Consider removing all entries with deficient sample size.")
 
-    for config, val in zip(entries, counts):
-        for d, (_, i) in zip(vecs, config):
-            val = val * d[:, i]
-        res = res + val
+    derived = entries[:, :, 1]
+    n_configs = len(derived)
+    if batch_size <= 0:
+        batch_size = max(n_configs, 1)
+
+    res = 0.
+    for start in range(0, n_configs, batch_size):
+        batch = slice(start, start + batch_size)
+        # gather the entries of each vecs[k] at the derived counts,
+        # and take their product over demes
+        prod = 1.
+        for d, i in zip(vecs, derived[batch].T):
+            prod = prod * d[:, i]
+        res = res + np.dot(prod, counts[batch])
     return res
 
 # TODO: rewrite commented code
@@ -466,7 +466,7 @@ class DemographicModel(object):
 
     def simulate_data(self, length, recoms_per_gen,
                       num_replicates, muts_per_gen=None,
-                      sampled_n_dict=None, **kwargs):
+                      sampled_n_dict=None, processes=None, **kwargs):
         """Simulate data, using msprime as backend
 
         :param int length: Length of each locus in bases
@@ -476,6 +476,10 @@ class DemographicModel(object):
         :param dict sampled_n_dict: Number of haploids per population. \
         If None, use sample sizes from the current dataset as set by \
         :meth:`DemographicModel.set_data`
+        :param int,None processes: If greater than 1, simulate the loci in this \
+        many subprocesses. Each block of loci is simulated with its own seed, \
+        drawn using ``random_seed`` (if given), so the result does not \
+        depend on the number of processes.
 
         :returns: Dataset of SNP allele counts
         :rtype: :class:`SnpAlleleCounts`
@@ -490,7 +494,7 @@ class DemographicModel(object):
             recombination_rate=4*self.N_e*recoms_per_gen,
             mutation_rate=4*self.N_e*muts_per_gen,
             num_replicates=num_replicates,
-            **kwargs)
+            processes=processes, **kwargs)
 
     def simulate_vcf(
             self, out_prefix,
@@ -500,7 +504,7 @@ class DemographicModel(object):
             sampled_n_dict=None, **kwargs):
         """Simulate a chromosome using msprime and write it to VCF
 
-        :param str,file outfile: Output VCF file. If a string ending in ".gz", gzip it.
+        :param str out_prefix: Prefix of the output files
         :param float muts_per_gen: Mutation rate per generation per base
         :param float recoms_per_gen: Recombination rate per generation per base
         :param int length: Length of chromosome in bases
@@ -510,6 +514,12 @@ class DemographicModel(object):
         :param dict sampled_n_dict: Number of haploids per population. \
         If None, use sample sizes from the current dataset as set by \
         :meth:`DemographicModel.set_data`
+        :param bool write_counts: If True, also write the allele counts \
+        to ``out_prefix + ".momi"``, which can be read with \
+        :meth:`SnpAlleleCounts.load` instead of parsing the VCF.
+
+        The VCF is written to ``out_prefix + ".vcf.gz"`` (bgzipped and \
+        tabix-indexed), and the simulated region to ``out_prefix + ".bed"``.
         """
         demo = self._get_demo(sampled_n_dict)
         if muts_per_gen is None:
@@ -863,7 +873,8 @@ class DemographicModel(object):
     def stochastic_optimize(
             self, num_iters, n_minibatches=None, snps_per_minibatch=None,
             rgen=None, printfreq=1, start_from_checkpoint=None,
-            save_to_checkpoint=None,  svrg_epoch=-1, **kwargs):
+            save_to_checkpoint=None,  svrg_epoch=-1, method="adam",
+            **kwargs):
         """Use stochastic optimization (ADAM+SVRG) to search for MLE
 
         Exactly one of of ``n_minibatches`` and ``snps_per_minibatch`` should be set, as one determines the other.
@@ -876,6 +887,8 @@ class DemographicModel(object):
         :param str start_from_checkpoint: Name of checkpoint file to start from
         :param str save_to_checkpoint: Name of checkpoint file to save to
         :param int svrg_epoch: How often to compute full likelihood for SVRG. -1=never.
+        :param str method: "adam" (default), or "saga"/"sag" to use a table of the most recent gradient per minibatch instead of SVRG. ``svrg_epoch`` is ignored unless ``method="adam"``.
+        :param int minibatches_per_step: Average the gradients of this many minibatches per step (``method="adam"`` only).
         :rtype: :class:`scipy.optimize.OptimizeResult`
         """
         def callback(x):
@@ -897,6 +910,8 @@ class DemographicModel(object):
         kwargs = dict(kwargs)
         kwargs["callback"] = callback
         kwargs["bounds"] = bounds
+        if method == "adam":
+            kwargs["svrg_epoch"] = svrg_epoch
 
         if start_from_checkpoint:
             with open(start_from_checkpoint) as f:
@@ -908,8 +923,7 @@ class DemographicModel(object):
             n_minibatches=n_minibatches,
             snps_per_minibatch=snps_per_minibatch,
             rgen=rgen).find_mle(
-                method="adam", num_iters=num_iters,
-                svrg_epoch=svrg_epoch,
+                method=method, num_iters=num_iters,
                 checkpoint_file=save_to_checkpoint, **kwargs)
 
         self._set_x(res.x)
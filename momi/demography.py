@@ -7,8 +7,11 @@ import scipy.sparse
 import autograd.numpy as np
 import msprime
 from .compute_sfs import expected_total_branch_len
-from .data.compressed_counts import _CompressedHashedCounts, _CompressedList
+from .data.compressed_counts import (
+    CompressedAlleleCounts, _CompressedHashedCounts, _CompressedList,
+    _merge_config_arrays)
 from .data.snps import SnpAlleleCounts
+from .data.binary import BINARY_EXTENSION
 from .util import memoize_instance
 from .math_functions import (
     binom_coeffs, roll_axes, hypergeom_quasi_inverse,
@@ -17,6 +20,7 @@ from .math_functions import (
 import pysam
 import os
 import itertools
+import concurrent.futures
 
 import logging
 logger = logging.getLogger(__name__)
@@ -307,56 +311,63 @@ class Demography(object):
                 parent2] == self._admixture_prob_idxs(admixture_node)
         return ret
 
-    def simulate_data(self, length, num_replicates=1, **kwargs):
-        treeseq = self.simulate_trees(length=length, num_replicates=num_replicates,
-                                      **kwargs)
-        try:
-            treeseq.variants
-        except:
-            pass
+    def simulate_data(self, length, num_replicates=1, processes=None,
+                      **kwargs):
+        # a seed for each block of replicates, so the replicates
+        # don't depend on how the blocks are split between processes
+        seeds, block_sizes = _replicate_seeds(
+            kwargs.pop("random_seed", None), num_replicates)
+        if processes is None or processes <= 1:
+            results = [_simulate_allele_counts(
+                self._msprime_kwargs(), self.sampled_n, seeds, block_sizes,
+                dict(length=length, **kwargs))]
         else:
-            treeseq = [treeseq]
-
-        mat = np.zeros((len(self.sampled_n), sum(self.sampled_n)), dtype=int)
-        j = 0
-        for i, n in enumerate(self.sampled_n):
-            for _ in range(n):
-                mat[i, j] = 1
-                j += 1
-        mat = scipy.sparse.csr_matrix(mat)
-
-        def get_config(genos):
-            derived_counts = mat.dot(genos)
-            return np.array([
-                self.sampled_n - derived_counts,
-                derived_counts
-            ]).T
-
-        #chrom = []
-        chrom = _CompressedList()
-        pos = []
-        compressed_counts = _CompressedHashedCounts(len(self.sampled_pops))
-
-        for c, locus in enumerate(treeseq):
-            for v in locus.variants():
-                compressed_counts.append(get_config(v.genotypes))
-                chrom.append(c)
-                pos.append(v.position)
+            jobs = np.array_split(
+                np.arange(len(seeds)), max(1, min(len(seeds), 4 * processes)))
+            with concurrent.futures.ProcessPoolExecutor(
+                    processes) as executor:
+                results = list(executor.map(
+                    _simulate_allele_counts,
+                    itertools.repeat(self._msprime_kwargs()),
+                    itertools.repeat(self.sampled_n),
+                    [seeds[job] for job in jobs],
+                    [block_sizes[job] for job in jobs],
+                    itertools.repeat(dict(length=length, **kwargs))))
+
+        n_loci, loci, positions, config_arrays, index2uniqs = zip(*results)
+        # locus indices continue across the chunks of replicates
+        chrom = np.concatenate([
+            offset + locus for offset, locus in zip(
+                np.cumsum((0,) + n_loci), loci)])
+        pos = np.concatenate(positions)
+        config_array, old2new_uniq = _merge_config_arrays(config_arrays)
+        index2uniq = np.concatenate([
+            old2new[index2uniq] for old2new, index2uniq in zip(
+                old2new_uniq, index2uniqs)])
+
+        # loci without variants don't appear in chrom
+        chrom_values, chrom = np.unique(chrom, return_inverse=True)
+        chrom = _CompressedList._from_index2uniq(
+            [int(c) for c in chrom_values], chrom)
 
         return SnpAlleleCounts(
-            chrom, pos, compressed_counts.compressed_allele_counts(),
+            chrom, pos, CompressedAlleleCounts(config_array, index2uniq),
             self.sampled_pops, use_folded_sfs=False,
             non_ascertained_pops=[], length=length*num_replicates,
-            n_read_snps=len(compressed_counts), n_excluded_snps=0)
+            n_read_snps=len(index2uniq), n_excluded_snps=0)
 
     def simulate_vcf(self, out_prefix, mutation_rate,
                      recombination_rate, length,
                      chrom_name=1, ploidy=1, random_seed=None,
-                     force=False, print_aa=True):
+                     force=False, print_aa=True, write_counts=False):
         out_prefix = os.path.expanduser(out_prefix)
-        vcf_name = out_prefix + ".vcf"
+        vcf_name = out_prefix + ".vcf.gz"
         bed_name = out_prefix + ".bed"
-        for fname in (vcf_name, bed_name):
+        counts_name = out_prefix + BINARY_EXTENSION
+        out_names = [vcf_name, bed_name]
+        if write_counts:
+            out_names.append(counts_name)
+        for fname in out_names:
             if not force and os.path.isfile(fname):
                 raise FileExistsError(
                     "{} exists and force=False".format(fname))
@@ -366,49 +377,71 @@ class Demography(object):
                              " integer multiple of ploidy")
 
         with open(bed_name, "w") as bed_f:
-            print(chrom_name, 0, length, sep="\t", file=bed_f)
-
-        with open(vcf_name, "w") as vcf_f:
-            treeseq = self.simulate_trees(
-                mutation_rate=mutation_rate,
-                recombination_rate=recombination_rate,
-                length=length, num_replicates=1,
-                random_seed=random_seed)
-
-            print("##fileformat=VCFv4.2", file=vcf_f)
-            print('##source="VCF simulated by momi2 using'
-                  ' msprime backend"', file=vcf_f)
-            print("##contig=<ID={chrom_name},length={length}>".format(
-                chrom_name=chrom_name, length=length), file=vcf_f)
-            print('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
-                  file=vcf_f)
-            print('##INFO=<ID=AA,Number=1,Type=String,Description="Ancestral Allele">',
-                  file=vcf_f)
-
-            n_samples = int(np.sum(self.sampled_n) / ploidy)
-            fields = ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL",
-                      "FILTER", "INFO", "FORMAT"]
-            for pop, n in zip(self.sampled_pops, self.sampled_n):
-                for i in range(int(n / ploidy)):
-                    fields.append("{}_{}".format(pop, i))
-            print(*fields, sep="\t", file=vcf_f)
-
-            loc = next(treeseq)
-            if print_aa:
-                info_str = "AA=A"
-            else:
-                info_str = "."
-
-            for v in loc.variants():
-                gt = np.reshape(v.genotypes, (n_samples, ploidy))
-                print(chrom_name, int(np.floor(v.position)),
-                      ".", "A", "T", ".", ".", info_str, "GT",
-                      *["|".join(map(str, sample)) for sample in gt],
-                      sep="\t", file=vcf_f)
-
-        pysam.tabix_index(vcf_name, preset="vcf", force=force)
+            print(chrom_name, 0, int(length), sep="\t", file=bed_f)
+
+        # seeded like the first replicate of simulate_data
+        (seed,), _ = _replicate_seeds(random_seed, 1)
+        treeseq = next(self.simulate_trees(
+            mutation_rate=mutation_rate,
+            recombination_rate=recombination_rate,
+            length=length, num_replicates=1,
+            random_seed=int(seed)))
+
+        header = ["##fileformat=VCFv4.2",
+                  '##source="VCF simulated by momi2 using'
+                  ' msprime backend"',
+                  "##contig=<ID={chrom_name},length={length}>".format(
+                      chrom_name=chrom_name, length=length),
+                  '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+                  '##INFO=<ID=AA,Number=1,Type=String,Description="Ancestral Allele">']
+        fields = ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL",
+                  "FILTER", "INFO", "FORMAT"]
+        for pop, n in zip(self.sampled_pops, self.sampled_n):
+            for i in range(int(n / ploidy)):
+                fields.append("{}_{}".format(pop, i))
+        header.append("\t".join(fields))
+
+        if print_aa:
+            info_str = "AA=A"
+        else:
+            info_str = "."
+        record_prefix = "{}\t{{}}\t.\tA\tT\t.\t.\t{}\tGT\t".format(
+            chrom_name, info_str)
+
+        positions = []
+        compressed_counts = _CompressedHashedCounts(len(self.sampled_n))
+        # write BGZF directly, so tabix doesn't have to recompress it
+        with pysam.BGZFile(vcf_name, "wb") as vcf_f:
+            vcf_f.write(("\n".join(header) + "\n").encode())
+            for chunk_positions, genos in _treeseq_genotype_chunks(
+                    treeseq, np.sum(self.sampled_n)):
+                chunk_positions = np.floor(chunk_positions).astype(int)
+                vcf_f.write(_vcf_records(
+                    record_prefix, chunk_positions, genos, ploidy))
+                if write_counts:
+                    compressed_counts.extend(
+                        _genotype_configs(genos, self.sampled_n))
+                    positions.append(chunk_positions)
+
+        pysam.tabix_index(vcf_name, preset="vcf", force=True)
+
+        if write_counts:
+            index2uniq = compressed_counts.index2uniq()
+            SnpAlleleCounts(
+                _CompressedList._from_index2uniq(
+                    [str(chrom_name)], np.zeros(len(index2uniq), dtype=int)),
+                np.concatenate([np.zeros(0, dtype=int)] + positions),
+                CompressedAlleleCounts(
+                    compressed_counts.config_array(), index2uniq),
+                self.sampled_pops, use_folded_sfs=not print_aa,
+                non_ascertained_pops=[], length=int(length),
+                n_read_snps=len(index2uniq),
+                n_excluded_snps=0).dump(counts_name)
 
     def simulate_trees(self, **kwargs):
+        return msprime.simulate(**self._msprime_kwargs(), **kwargs)
+
+    def _msprime_kwargs(self):
         sampled_t = self.sampled_t
         if sampled_t is None:
             sampled_t = 0.0
@@ -422,7 +455,7 @@ class Demography(object):
             if e is not None:
                 demographic_events.append(e)
 
-        return msprime.simulate(
+        return dict(
             population_configurations=[
                 msprime.PopulationConfiguration()
                 for _ in range(len(pops))],
@@ -433,8 +466,7 @@ class Demography(object):
                 for p, t, n in zip(
                         self.sampled_pops, self.sampled_t,
                         self.sampled_n)
-                for _ in range(n)],
-            **kwargs)
+                for _ in range(n)])
 
 
 def rescale_events(events, factor):
@@ -566,21 +598,131 @@ def _build_event_tree(G):
 
 
 
+# replicates simulated with the same seed by
+# Demography.simulate_data; one call to msprime.simulate
+# per replicate has too much overhead for short loci
+_REPLICATES_PER_SEED = 16
+
+
+def _replicate_seeds(random_seed, num_replicates):
+    # the msprime seed and number of replicates of each block of
+    # (up to) _REPLICATES_PER_SEED replicates, drawn using random_seed
+    block_sizes = np.diff(np.append(np.arange(
+        0, num_replicates, _REPLICATES_PER_SEED), num_replicates))
+    seeds = np.random.RandomState(random_seed).randint(
+        1, 2**31, size=len(block_sizes))
+    return seeds, block_sizes
+
+
+def _simulate_allele_counts(msprime_kwargs, sampled_n, seeds, block_sizes,
+                            kwargs):
+    # simulates a block of replicates for each seed,
+    # in a subprocess if Demography.simulate_data(processes > 1)
+    return _treeseq_allele_counts(
+        itertools.chain.from_iterable(
+            msprime.simulate(random_seed=int(seed), num_replicates=int(n),
+                             **msprime_kwargs, **kwargs)
+            for seed, n in zip(seeds, block_sizes)), sampled_n)
+
+
+def _treeseq_allele_counts(treeseqs, sampled_n):
+    # returns the number of loci, and the locus, position, and config index
+    # of each variant, along with the array of unique configs
+    locus = []
+    pos = []
+    compressed_counts = _CompressedHashedCounts(len(sampled_n))
+
+    n_loci = 0
+    for c, treeseq in enumerate(treeseqs):
+        n_loci += 1
+        for positions, configs in _treeseq_config_chunks(
+                treeseq, sampled_n):
+            compressed_counts.extend(configs)
+            locus.append(np.full(len(positions), c, dtype=int))
+            pos.append(positions)
+
+    return (n_loci, np.concatenate([np.zeros(0, dtype=int)] + locus),
+            np.concatenate([np.zeros(0)] + pos),
+            compressed_counts.config_array(), compressed_counts.index2uniq())
+
+
 def get_treeseq_configs(treeseq, sampled_n):
-    mat = np.zeros((len(sampled_n), sum(sampled_n)), dtype=int)
-    j = 0
-    for i, n in enumerate(sampled_n):
-        for _ in range(n):
-            mat[i, j] = 1
-            j += 1
-    mat = scipy.sparse.csr_matrix(mat)
-
-    def get_config(genos):
-        derived_counts = mat.dot(genos)
-        return np.array([
-            sampled_n - derived_counts,
-            derived_counts
-        ]).T
-
-    for v in treeseq.variants():
-        yield get_config(v.genotypes)
+    for _, configs in _treeseq_config_chunks(treeseq, sampled_n):
+        yield from configs
+
+
+def _treeseq_config_chunks(treeseq, sampled_n, chunk_size=None):
+    """
+    Yields the positions and configs of the variants in treeseq,
+    in chunks of up to chunk_size variants.
+    """
+    for positions, genos in _treeseq_genotype_chunks(
+            treeseq, np.sum(sampled_n), chunk_size):
+        yield positions, _genotype_configs(genos, sampled_n)
+
+
+# default memory budget of a genotype matrix chunk
+_GENOTYPE_CHUNK_BYTES = 2**26
+
+
+def _treeseq_genotype_chunks(treeseq, n_samples, chunk_size=None):
+    """
+    Yields the positions and genotype matrix of the variants in treeseq,
+    in chunks of up to chunk_size variants (by default, as many as fit
+    in _GENOTYPE_CHUNK_BYTES).
+
+    The genotype matrix has a row per variant and a column per sample.
+    Each chunk is computed with one call to genotype_matrix(),
+    on the tree sequence restricted to the chunk's sites.
+    """
+    if chunk_size is None:
+        chunk_size = max(1, _GENOTYPE_CHUNK_BYTES // max(1, n_samples))
+    # the variants are the sites, in order
+    positions = np.array(treeseq.tables.sites.position)
+    bounds = np.append(positions, treeseq.sequence_length)
+    for start in range(0, len(positions), chunk_size):
+        end = min(start + chunk_size, len(positions))
+        if start == 0 and end == len(positions):
+            chunk = treeseq
+        else:
+            # keep the nodes (simplify=False), so the samples stay in order
+            chunk = treeseq.keep_intervals(
+                [[bounds[start], bounds[end]]], simplify=False,
+                record_provenance=False)
+        genos = chunk.genotype_matrix()
+        assert genos.shape == (end - start, n_samples)
+        yield positions[start:end], genos
+
+
+def _genotype_configs(genos, sampled_n):
+    # the derived counts of all the variants
+    # are computed with a single sparse-dense product
+    sampled_n = np.array(sampled_n, dtype=int)
+    mat = scipy.sparse.csr_matrix((
+        np.ones(np.sum(sampled_n), dtype=int),
+        (np.repeat(np.arange(len(sampled_n)), sampled_n),
+         np.arange(np.sum(sampled_n)))))
+    derived_counts = mat.dot(genos.T).T
+    return np.stack([sampled_n - derived_counts, derived_counts], axis=2)
+
+
+def _vcf_records(record_prefix, positions, genos, ploidy):
+    """
+    Returns the VCF records of a chunk of biallelic variants, as bytes.
+
+    The genotype columns of the whole chunk are formatted at once,
+    as a byte matrix with a row per record.
+    """
+    n_variants, n_haps = genos.shape
+    gt_bytes = np.empty((n_variants, n_haps, 2), dtype=np.uint8)
+    gt_bytes[:, :, 0] = genos + ord("0")
+    gt_bytes[:, :, 1] = ord("|")
+    gt_bytes[:, ploidy-1::ploidy, 1] = ord("\t")
+    gt_bytes[:, -1, 1] = ord("\n")
+    gt_bytes = gt_bytes.tobytes()
+
+    row_len = 2 * n_haps
+    return b"".join(itertools.chain.from_iterable(
+        (record_prefix.format(pos).encode(),
+         gt_bytes[i*row_len:(i+1)*row_len])
+        for i, pos in enumerate(positions.tolist())))
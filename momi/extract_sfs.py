@@ -9,13 +9,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--verbose", action="store_true")
     parser.add_argument(
-        "out", type=str, help="Output file")
+        "out", type=str, help="Output file. If ends with .gz, gzip it. If ends with .momi, store it in binary format.")
     parser.add_argument(
         "n_blocks", type=int, default=1,
         help="Number of blocks for jackknife/bootstrap")
+    parser.add_argument(
+        "--counts_out", default=None,
+        help="Also write the (concatenated) SNP allele counts to this file. If ends with .momi, store it in binary format.")
     parser.add_argument(
         "files", nargs="+",
-        help="Files containing SNP allele counts")
+        help="Files containing SNP allele counts, in json or binary (.momi) format")
 
     args = parser.parse_args()
 
@@ -30,5 +33,8 @@ if __name__ == "__main__":
             SnpAlleleCounts.load(fname)
             for fname in args.files)
 
+    if args.counts_out:
+        counts.dump(args.counts_out)
+
     logging.info("Extracting SFS...")
     counts.extract_sfs(args.n_blocks).dump(args.out)
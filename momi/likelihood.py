@@ -6,8 +6,9 @@ import autograd.numpy as np
 import scipy
 import autograd as ag
 from autograd.extend import primitive, defvjp
+from autograd.differential_operators import make_jvp_reversemode
 from .optimizers import _find_minimum, stochastic_opts, LoggingCallback
-from .compute_sfs import expected_sfs, expected_total_branch_len, expected_heterozygosity
+from .compute_sfs import expected_sfs, expected_total_branch_len, expected_heterozygosity, _expected_sfs_unnormalized, _expected_sfs_denoms
 from .demography import Demography
 from .data.configurations import _ConfigList_Subset
 from .data.sfs import Sfs
@@ -108,15 +109,14 @@ class SfsLikelihoodSurface(object):
         return -ag.hessian(self.log_lik)(x)
 
     def _score_cov(self, params):
-        params = np.array(params)
-
-        def f_vec(x):
-            ret = self._log_lik(x, vector=True)
-            # centralize
-            return ret - np.mean(ret)
-
-        j = ag.jacobian(f_vec)(params)
-        return np.einsum('ij, ik', j, j)
+        # the log prior is the same for every locus,
+        # so it drops out of the centralized scores
+        return _score_cov(
+            self.sfs, self.demo_func, params, mut_rate=self.mut_rate,
+            truncate_probs=self.truncate_probs, p_missing=self.p_missing,
+            use_pairwise_diffs=self.use_pairwise_diffs,
+            batch_size=self.batch_size, folded=self.folded,
+            error_matrices=self.error_matrices)
 
     def _log_lik(self, x, vector):
         demo = self._get_multipop_moran(x)
@@ -140,12 +140,21 @@ class SfsLikelihoodSurface(object):
         if self.sfs_batches:
             G = demo._get_graph_structure()
             cache = demo._get_differentiable_part()
+            # the normalization constants are shared by the batches,
+            # so compute them once, in a separate (small) pass
+            sfs_denoms = _expected_sfs_denoms(
+                demo, self.sfs.configs, self.folded, self.error_matrices)
             ret = 0.0
             for batch in self.sfs_batches:
+                if batch is self.sfs:
+                    batch_denoms = sfs_denoms
+                else:
+                    batch_denoms = sfs_denoms[batch.configs.sub_idxs]
                 ret = ret + _raw_log_lik(
                     cache, G, batch,
                     self.truncate_probs, self.folded,
-                    self.error_matrices, vector)
+                    self.error_matrices, vector,
+                    sfs_denoms=batch_denoms)
         else:
             ret = _composite_log_likelihood(
                 self.data, demo, truncate_probs=self.truncate_probs,
@@ -274,7 +283,7 @@ class SfsLikelihoodSurface(object):
             bounds=None, callback=None,
             checkpoint_file=None, checkpoint_iter=10,
             svrg_epoch=-1, b1=0.9, b2=0.999, eps=10**-8,
-            rgen=np.random):
+            rgen=np.random, method="adam"):
         """
         Search for maximum likelihood using ADAM-style
         stochastic gradient descent.
@@ -313,14 +322,23 @@ class SfsLikelihoodSurface(object):
 
             Alternatively, use numpy.random.RandomState to create
             a separate random generator and pass it in here.
+        method: str
+            "adam" (the default), or "saga"/"sag".
+
+            SAGA and SAG keep a table with the most recent gradient
+            of every minibatch, and step along the running mean of the
+            table. Like SVRG this reduces the variance of the stochastic
+            gradient, but without periodic passes over the full data.
+            The ADAM parameters (svrg_epoch, b1, b2, eps) are ignored.
         """
         kwargs = {}
         kwargs["stepsize"] = stepsize
         kwargs["num_iters"] = num_iters
-        kwargs["b1"] = b1
-        kwargs["b2"] = b2
-        kwargs["eps"] = eps
-        kwargs["svrg_epoch"] = svrg_epoch
+        if method == "adam":
+            kwargs["b1"] = b1
+            kwargs["b2"] = b2
+            kwargs["eps"] = eps
+            kwargs["svrg_epoch"] = svrg_epoch
         kwargs["checkpoint_file"] = checkpoint_file
         kwargs["checkpoint_iter"] = checkpoint_iter
         kwargs["callback"] = callback
@@ -334,7 +352,7 @@ class SfsLikelihoodSurface(object):
 
         return self._stochastic_surfaces(
             snps_per_minibatch=snps_per_minibatch,
-            rgen=rgen).find_mle(**kwargs)
+            rgen=rgen).find_mle(method=method, **kwargs)
 
     def _get_stochastic_pieces(self, pieces, rgen):
         sfs_pieces = _subsfs_list(self.sfs, pieces, rgen)
@@ -417,9 +435,9 @@ def _composite_log_likelihood(data, demo, mut_rate=None, truncate_probs=0.0, vec
     except AttributeError:
         sfs = data
 
-    sfs_probs = np.maximum(expected_sfs(demo, sfs.configs, normalized=True, **kwargs),
-                           truncate_probs)
-    log_lik = sfs._integrate_sfs(np.log(sfs_probs), vector=vector)
+    log_lik = _sfs_log_lik(
+        sfs, expected_sfs(demo, sfs.configs, normalized=True, **kwargs),
+        truncate_probs, vector)
 
     # add on log likelihood of poisson distribution for total number of SNPs
     if mut_rate is not None:
@@ -432,6 +450,59 @@ def _composite_log_likelihood(data, demo, mut_rate=None, truncate_probs=0.0, vec
     return log_lik
 
 
+def _sfs_log_lik(sfs, sfs_probs, truncate_probs, vector):
+    sfs_probs = np.maximum(sfs_probs, truncate_probs)
+    return sfs._integrate_sfs(np.log(sfs_probs), vector=vector)
+
+
+def _score_cov(data, demo_func, params, mut_rate=None, truncate_probs=0.0, p_missing=None, use_pairwise_diffs=False, batch_size=1000, **kwargs):
+    """
+    Covariance of the per-locus scores, sum_l (s_l - mean(s)) (s_l - mean(s))^T,
+    where s_l is the gradient of the composite log-likelihood of locus l.
+
+    Instead of differentiating the vector of per-locus log-likelihoods,
+    this computes the per-config gradients of the log SFS probabilities
+    (one Jacobian-vector product per parameter, in batches of configs),
+    and gets the per-locus scores with the sparse product
+    freqs_matrix.T @ jacobian.
+    """
+    try:
+        sfs = data.sfs
+    except AttributeError:
+        sfs = data
+    params = np.array(params, dtype=float)
+
+    if batch_size <= 0:
+        batches = [sfs]
+    else:
+        batches = _build_sfs_batches(sfs, batch_size)
+
+    scores = np.zeros((sfs.n_loci, len(params)))
+    for batch in batches:
+        def log_probs(x):
+            return np.log(np.maximum(expected_sfs(
+                demo_func(*x), batch.configs, normalized=True, **kwargs),
+                                     truncate_probs))
+        scores = scores + batch.freqs_matrix.T.dot(
+            _jacobian_reversemode(log_probs, params))
+
+    if mut_rate is not None:
+        scores = scores + _jacobian_reversemode(
+            lambda x: _mut_factor(sfs, demo_func(*x), mut_rate, True,
+                                  p_missing, use_pairwise_diffs),
+            params)
+
+    # centralize
+    scores = scores - np.mean(scores, axis=0)
+    return np.dot(scores.T, scores)
+
+
+def _jacobian_reversemode(fun, x):
+    # one reverse pass per input, rather than per output
+    jvp = make_jvp_reversemode(fun)(x)
+    return np.array([jvp(e) for e in np.eye(len(x))]).T
+
+
 def _mut_factor(sfs, demo, mut_rate, vector, p_missing, use_pairwise_diffs):
     if use_pairwise_diffs:
         return _mut_factor_het(sfs, demo, mut_rate, vector, p_missing)
@@ -477,6 +548,11 @@ def _mut_factor_total(sfs, demo, mut_rate, vector):
         ret = np.sum(ret)
     return ret
 
+# key of the normalization constants passed to _raw_log_lik,
+# alongside the Demography cache
+_SFS_DENOMS_KEY = "_sfs_denoms"
+
+
 def rearrange_dict_grad(fun):
     """
     Decorator that allows us to save memory on the forward pass,
@@ -503,10 +579,22 @@ def rearrange_dict_grad(fun):
         return wrapped_fun_helper(ag.dict(xdict), lambda:None)
     return wrapped_fun
 
-def _raw_log_lik(cache, G, data, truncate_probs, folded, error_matrices, vector=False):
+def _raw_log_lik(cache, G, data, truncate_probs, folded, error_matrices, vector=False, sfs_denoms=None):
+    if sfs_denoms is not None:
+        # differentiate the normalization constants along with the cache
+        cache = dict(cache)
+        cache[_SFS_DENOMS_KEY] = sfs_denoms
+
     def wrapped_fun(cache):
         demo = Demography(G, cache=cache)
-        return _composite_log_likelihood(data, demo, truncate_probs=truncate_probs, folded=folded, error_matrices=error_matrices, vector=vector)
+        if sfs_denoms is None:
+            return _composite_log_likelihood(data, demo, truncate_probs=truncate_probs, folded=folded, error_matrices=error_matrices, vector=vector)
+        sfs_probs = _expected_sfs_unnormalized(
+            demo, data.configs, folded, error_matrices) / cache[_SFS_DENOMS_KEY]
+        log_lik = _sfs_log_lik(data, sfs_probs, truncate_probs, vector)
+        if not vector:
+            log_lik = np.squeeze(log_lik)
+        return log_lik
     if vector:
         return ag.checkpoint(wrapped_fun)(cache)
     else:
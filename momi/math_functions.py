@@ -190,6 +190,17 @@ log_binom = lambda n, k: log_factorial(
     n) - log_factorial(k) - log_factorial(n - k)
 
 
+@memoize
+def log_factorial_table(n):
+    """
+    log(k!) for k = 0,...,n, so that log binomial coefficients
+    with top entry at most n are sums of its entries.
+    """
+    ret = log_factorial(np.arange(n + 1))
+    ret.setflags(write=False)
+    return ret
+
+
 def hypergeom_mat(N, n):
     K = np.outer(np.ones(n + 1), np.arange(N + 1))
     k = np.outer(np.arange(n + 1), np.ones(N + 1))
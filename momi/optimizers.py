@@ -140,7 +140,7 @@ def sgd(fun, x0, fun_and_jac, pieces, stepsize, num_iters, bounds=None, callback
 
 
 @is_stoch_opt
-def adam(fun, x0, fun_and_jac, pieces, num_iters, stepsize=.1, b1=0.9, b2=0.999, eps=10**-8, svrg_epoch=-1, bounds=None, callback=None, rgen=np.random, xtol=1e-6, w=None, fbar=None, gbar=None, checkpoint_file=None, checkpoint_iter=10, start_iter=0, m=None, v=None):
+def adam(fun, x0, fun_and_jac, pieces, num_iters, stepsize=.1, b1=0.9, b2=0.999, eps=10**-8, svrg_epoch=-1, bounds=None, callback=None, rgen=np.random, xtol=1e-6, w=None, fbar=None, gbar=None, checkpoint_file=None, checkpoint_iter=10, start_iter=0, m=None, v=None, minibatches_per_step=1):
     x0 = np.array(x0)
 
     if callback is None:
@@ -175,8 +175,8 @@ def adam(fun, x0, fun_and_jac, pieces, num_iters, stepsize=.1, b1=0.9, b2=0.999,
     prev_close = False
     success = False
     for nit in range(start_iter, num_iters):
-        i = rgen.randint(pieces)
-        f_x, g_x = fun_and_jac(x, i)
+        idxs = _draw_minibatches(rgen, pieces, minibatches_per_step)
+        f_x, g_x = _average_minibatches(fun_and_jac, x, idxs)
 
         if svrg_epoch > 0 and nit // svrg_epoch and nit % svrg_epoch == 0:
             w = x
@@ -184,7 +184,7 @@ def adam(fun, x0, fun_and_jac, pieces, num_iters, stepsize=.1, b1=0.9, b2=0.999,
             #logger.info("SVRG pivot, {0}".format(
             #    {"w": list(w), "fbar": fbar, "gbar": list(gbar)}))
         if w is not None:
-            f_w, g_w = fun_and_jac(w, i)
+            f_w, g_w = _average_minibatches(fun_and_jac, w, idxs)
             f_x = f_x - f_w + fbar
             g_x = g_x - g_w + gbar
 
@@ -227,6 +227,129 @@ def adam(fun, x0, fun_and_jac, pieces, num_iters, stepsize=.1, b1=0.9, b2=0.999,
                     "v": to_list(v),
                     "x0": to_list(x)}, f)
 
+    if success:
+        message = "|x[k]-x[k-1]|~=0"
+    else:
+        message = "Maximum number of iterations reached"
+
+    return scipy.optimize.OptimizeResult({'x': x, 'fun': f_x, 'jac': g_x, 'nit': nit, 'message': message,
+                                          'success': success})
+
+
+def _draw_minibatches(rgen, pieces, minibatches_per_step):
+    if minibatches_per_step == 1:
+        return [rgen.randint(pieces)]
+    return list(rgen.randint(pieces, size=minibatches_per_step))
+
+
+def _average_minibatches(fun_and_jac, x, idxs):
+    if len(idxs) == 1:
+        return fun_and_jac(x, idxs[0])
+    f, g = zip(*[fun_and_jac(x, i) for i in idxs])
+    return np.mean(f), np.mean(g, axis=0)
+
+
+@is_stoch_opt
+def saga(fun, x0, fun_and_jac, pieces, num_iters, stepsize=.1, **kwargs):
+    return _gradient_table_descent(fun, x0, fun_and_jac, pieces, stepsize,
+                                   num_iters, unbiased=True, **kwargs)
+
+
+@is_stoch_opt
+def sag(fun, x0, fun_and_jac, pieces, num_iters, stepsize=.1, **kwargs):
+    return _gradient_table_descent(fun, x0, fun_and_jac, pieces, stepsize,
+                                   num_iters, unbiased=False, **kwargs)
+
+
+def _gradient_table_descent(fun, x0, fun_and_jac, pieces, stepsize, num_iters, unbiased, bounds=None, callback=None, rgen=np.random, xtol=1e-6, checkpoint_file=None, checkpoint_iter=10, start_iter=0, grad_table=None, fun_table=None, seen=None):
+    # SAG/SAGA: store the most recent gradient of every minibatch,
+    # and update their mean incrementally. Unlike SVRG, this never
+    # requires a pass over the full dataset. Minibatches that have not
+    # been visited yet are left out of the mean.
+    x0 = np.array(x0)
+
+    if callback is None:
+        callback = lambda *a, **kw: None
+
+    if bounds is None:
+        bounds = [(None, None) for _ in x0]
+    lower, upper = zip(*bounds)
+    lower = [-float('inf') if l is None else l
+             for l in lower]
+    upper = [float('inf') if u is None else u
+             for u in upper]
+
+    def truncate(x):
+        return np.maximum(np.minimum(x, upper), lower)
+
+    if grad_table is None:
+        grad_table = np.zeros((pieces, len(x0)))
+    else:
+        grad_table = np.array(grad_table)
+    if fun_table is None:
+        fun_table = np.zeros(pieces)
+    else:
+        fun_table = np.array(fun_table)
+    if seen is None:
+        seen = np.zeros(pieces, dtype=bool)
+    else:
+        seen = np.array(seen, dtype=bool)
+    assert grad_table.shape == (pieces, len(x0))
+    assert fun_table.shape == seen.shape == (pieces,)
+
+    g_sum = np.sum(grad_table, axis=0)
+    f_sum = np.sum(fun_table)
+    n_seen = int(np.sum(seen))
+
+    x = x0
+    prev_close = False
+    success = False
+    for nit in range(start_iter, num_iters):
+        i = rgen.randint(pieces)
+        f_i, g_i = fun_and_jac(x, i)
+
+        prev_g, prev_f = grad_table[i], fun_table[i]
+        prev_n_seen = n_seen
+        if unbiased and seen[i]:
+            # SAGA: unbiased estimate, centered on the previous mean
+            g_x = g_i - prev_g + g_sum / prev_n_seen
+            f_x = f_i - prev_f + f_sum / prev_n_seen
+
+        if not seen[i]:
+            seen[i] = True
+            n_seen += 1
+        g_sum = g_sum + g_i - prev_g
+        f_sum = f_sum + f_i - prev_f
+        grad_table[i] = g_i
+        fun_table[i] = f_i
+
+        if not unbiased or prev_n_seen != n_seen:
+            # SAG, or SAGA while the table is still being filled
+            g_x = g_sum / n_seen
+            f_x = f_sum / n_seen
+
+        callback(x, f_x, nit)
+
+        prev_x = x
+        x = truncate(x - stepsize * g_x)
+
+        # require x to not change for 2 steps in a row before stopping
+        if xtol < 0 or not np.allclose(x, prev_x, xtol, xtol):
+            prev_close = False
+        elif prev_close:
+            success = True
+            break
+        else:
+            prev_close = True
+
+        if checkpoint_file is not None and nit % checkpoint_iter == 0:
+            with open(checkpoint_file, "w") as f:
+                json.dump({
+                    "start_iter": nit+1,
+                    "grad_table": grad_table.tolist(),
+                    "fun_table": fun_table.tolist(),
+                    "seen": seen.tolist(),
+                    "x0": list(x)}, f)
 
     if success:
         message = "|x[k]-x[k-1]|~=0"
@@ -1,4 +1,5 @@
-"""Runnable module to convert VCF file to :class:`SnpAlleleCounts`.
+"""Runnable module to convert VCF file to :class:`SnpAlleleCounts`, \
+or directly to :class:`Sfs` with ``--sfs_only``.
 
 Run this from the command line like ``python -m momi.read_vcf ...``. \
 See the ``--help`` flag for command line options. \
@@ -8,7 +9,7 @@ Use :meth:`SnpAlleleCounts.read_vcf` to read the VCF from within Python.
 import argparse
 import sys
 import logging
-from .data.snps import SnpAlleleCounts
+from .data.snps import SnpAlleleCounts, read_vcf_sfs
 
 
 if __name__ == "__main__":
@@ -16,12 +17,20 @@ if __name__ == "__main__":
     parser.add_argument("vcf_file", help="VCF file to read")
     parser.add_argument("ind2pop",
                         help="File whose first column is individual ID and second column is population ID")
-    parser.add_argument("out_file", help="Output file to store counts. If ends with .gz, gzip it.")
+    parser.add_argument("out_file", help="Output file to store counts. If ends with .gz, gzip it. If ends with .momi, store it in binary format.")
     parser.add_argument("--bed", help="Mask file specifying which regions to read. Also used to determine the size of the data in bases. If not provided then user will need to manually specify the length when required. Do NOT use the same BED file across multiple VCFs or the length of those regions will be double-counted!")
     parser.add_argument("--no_aa", action='store_true',
                         help="Ignore AA information entirely; use folded SFS downstream.")
     parser.add_argument("--outgroup", default=None,
                         help="Set this population as outgroup to determine ancestral allele, instead of using the AA info field. Note the outgroup will not appear in the created data (as it always has allele 0).")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Number of processes to read the VCF with. The BED regions (or the contigs, if no BED is given) are split between the processes. Requires an indexed VCF.")
+    parser.add_argument("--sfs_only", action="store_true",
+                        help="Store the SFS instead of the SNP allele counts. The SFS is accumulated while reading, without storing the individual SNPs, so uses much less memory.")
+    parser.add_argument("--blocks", type=int, default=None,
+                        help="With --sfs_only, number of blocks (of nearly equal numbers of SNPs) for jackknife/bootstrap. By default, each chromosome is a block.")
+    parser.add_argument("--block_bp", type=int, default=None,
+                        help="With --sfs_only, split the SFS into blocks of this many bases on each chromosome, instead of using --blocks.")
     parser.add_argument("--verbose", action="store_true")
     parser.add_argument("--info_aa_field", default="AA", help="INFO field to read ancestral allele from. Default is AA. Has no effect if --outgroup or --no_aa are set.")
     args = parser.parse_args()
@@ -39,7 +48,16 @@ if __name__ == "__main__":
     else:
         ancestral_alleles = True
 
-    SnpAlleleCounts.read_vcf(
-        args.vcf_file, ind2pop, bed_file=args.bed,
-        ancestral_alleles=ancestral_alleles,
-        info_aa_field=args.info_aa_field).dump(args.out_file)
+    if args.sfs_only:
+        read_vcf_sfs(
+            args.vcf_file, ind2pop, n_blocks=args.blocks,
+            block_bp=args.block_bp, bed_file=args.bed,
+            ancestral_alleles=ancestral_alleles,
+            info_aa_field=args.info_aa_field,
+            processes=args.threads).dump(args.out_file)
+    else:
+        SnpAlleleCounts.read_vcf(
+            args.vcf_file, ind2pop, bed_file=args.bed,
+            ancestral_alleles=ancestral_alleles,
+            info_aa_field=args.info_aa_field,
+            processes=args.threads).dump(args.out_file)
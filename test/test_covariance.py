@@ -104,3 +104,43 @@ import scipy
 #    #    raise
 #    # else:
 #    #    os.remove(fname)
+
+
+@pytest.mark.parametrize("cone", [(1, -1, None, 1, 0),
+                                  (1, 1, 1, 1, 1),
+                                  (None, -1, 0, None, 0)])
+def test_project_scores(cone):
+    from momi.confidence_region import _project_scores
+    n_params = len(cone)
+    a = np.random.normal(size=(n_params, n_params))
+    fisher = np.dot(a, a.T) + np.eye(n_params)
+    sims = np.random.multivariate_normal(
+        np.zeros(n_params), fisher, size=200)
+
+    liks, mles = _project_scores(sims, fisher, cone, psd_rtol=1e-8)
+    ref_liks, ref_mles = _project_scores(sims, fisher, cone, psd_rtol=1e-8,
+                                         method="l-bfgs-b")
+    assert np.allclose(liks, ref_liks, atol=1e-5)
+    assert np.allclose(mles, ref_mles, atol=1e-3)
+
+    pool_liks, pool_mles = _project_scores(sims, fisher, cone, psd_rtol=1e-8,
+                                           processes=2)
+    assert np.allclose(liks, pool_liks) and np.allclose(mles, pool_mles)
+
+
+@pytest.mark.parametrize("cone", [(1, None, -1), (1, 0, None)])
+def test_project_scores_singular_fisher(cone):
+    from momi.confidence_region import _project_scores
+    a = np.random.normal(size=(3, 2))
+    fisher = np.dot(a, a.T)
+    sims = np.random.multivariate_normal(np.zeros(3), fisher, size=50)
+
+    liks, mles = _project_scores(sims, fisher, cone, psd_rtol=1e-8)
+    ref_liks, _ = _project_scores(sims, fisher, cone, psd_rtol=1e-8,
+                                  method="l-bfgs-b")
+    assert np.all(np.isfinite(liks))
+    assert np.allclose(liks, ref_liks, atol=1e-5)
+    # the mles are not unique, but should attain the liks
+    assert np.allclose(
+        liks, np.einsum("ij,ij->i", mles, sims) -
+        .5 * np.einsum("ij,ij->i", mles, np.dot(mles, fisher)), atol=1e-5)
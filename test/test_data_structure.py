@@ -1,4 +1,6 @@
 import json
+import pytest
+import scipy.stats
 import os
 import momi
 from momi.data.compressed_counts import CompressedAlleleCounts
@@ -7,6 +9,7 @@ from io import StringIO
 from demo_utils import simple_five_pop_demo
 import autograd.numpy as np
 from collections import Counter
+import itertools as it
 
 
 def test_combine_loci():
@@ -64,3 +67,262 @@ def test_load_data():
             use_folded_sfs=info["use_folded_sfs"])
 
     assert data._sfs == data2._sfs
+
+
+def test_load_binary_data(tmpdir):
+    demo = simple_five_pop_demo()
+    num_bases = 1000
+    data = demo.simulate_data(
+        num_bases, recoms_per_gen=0,
+        num_replicates=100,
+        muts_per_gen=.1/num_bases,
+        sampled_n_dict=dict(zip(demo.leafs, [10]*5)))
+
+    data_path = str(tmpdir.join("test_data.momi"))
+    data.dump(data_path)
+    data2 = momi.SnpAlleleCounts.load(data_path)
+
+    assert data == data2
+    assert list(data.populations) == list(data2.populations)
+    assert data.extract_sfs(10) == data2.extract_sfs(10)
+
+
+def test_load_binary_sfs(tmpdir):
+    demo = simple_five_pop_demo()
+    num_bases = 1000
+    sfs = demo.simulate_data(
+        num_bases, recoms_per_gen=0,
+        num_replicates=100,
+        muts_per_gen=.1/num_bases,
+        sampled_n_dict=dict(zip(demo.leafs, [10]*5))).extract_sfs(10)
+
+    sfs_path = str(tmpdir.join("test_sfs.momi"))
+    sfs.dump(sfs_path)
+    sfs2 = momi.Sfs.load(sfs_path)
+
+    assert sfs == sfs2
+    assert sfs.combine_loci() == sfs2.combine_loci()
+    assert np.all(sfs.sampled_n == sfs2.sampled_n)
+    assert np.allclose(sfs.avg_pairwise_hets, sfs2.avg_pairwise_hets)
+
+    idxs = np.arange(len(sfs.configs))[::2]
+    assert sfs._subset_configs(idxs) == sfs2._subset_configs(idxs)
+
+
+@pytest.mark.parametrize("max_count", [10, 2**40])
+def test_compressed_hashed_counts(max_count):
+    from momi.data.compressed_counts import _CompressedHashedCounts
+    configs = np.random.randint(0, 3, size=(1000, 4, 2)) * (max_count // 2)
+
+    config2uniq = {}
+    index2uniq = []
+    for c in configs:
+        index2uniq.append(config2uniq.setdefault(c.tobytes(), len(config2uniq)))
+    uniq = np.array([np.frombuffer(c, dtype=configs.dtype).reshape(4, 2)
+                     for c in config2uniq.keys()])
+
+    hashed = _CompressedHashedCounts(4)
+    hashed._min_chunk = 50
+    for c in configs:
+        hashed.append(c)
+    assert len(hashed) == len(configs)
+    assert np.all(hashed.config_array() == uniq)
+    assert np.all(hashed.index2uniq() == index2uniq)
+
+
+def test_concatenate():
+    demo = simple_five_pop_demo()
+    num_bases = 1000
+    data = demo.simulate_data(
+        num_bases, recoms_per_gen=0,
+        num_replicates=100,
+        muts_per_gen=.1/num_bases,
+        sampled_n_dict=dict(zip(demo.leafs, [10]*5)))
+
+    idxs = np.arange(len(data))
+    pieces = [data.filter(idxs[i::3]) for i in range(3)]
+    for p in pieces:
+        p.length = data.length / 3.
+    data2 = momi.SnpAlleleCounts.concatenate(reversed(pieces))
+
+    assert list(data2.chrom_ids) == list(data.chrom_ids)
+    assert np.all(data2.positions == data.positions)
+    assert np.all(data2.compressed_counts.config_array[
+        data2.compressed_counts.index2uniq] == data.compressed_counts.config_array[
+            data.compressed_counts.index2uniq])
+    assert data2.extract_sfs(10) == data.extract_sfs(10)
+
+
+def test_concatenate_interleaved_chroms():
+    # each dataset has several chromosomes, which interleave
+    # with the chromosomes and positions of the other datasets
+    rng = np.random.RandomState(1)
+    snps = []
+    for chroms in (["chr3", "chr1"], ["chr2", "chr1", "chr4"], ["chr3"]):
+        dataset = []
+        for chrom in chroms:
+            for pos in rng.choice(1000, size=20, replace=False):
+                dataset.append((chrom, pos, rng.randint(0, 5, size=2)))
+        snps.append(dataset)
+
+    def to_counts(dataset):
+        chrom, pos, derived = zip(*dataset)
+        return momi.snp_allele_counts(
+            chrom, pos, ["a", "b"], [4 - d for d in derived], derived)
+
+    data = momi.SnpAlleleCounts.concatenate(map(to_counts, snps))
+    expected = sorted(it.chain(*snps), key=lambda snp: snp[:2])
+    assert list(data.chrom_ids) == [chrom for chrom, _, _ in expected]
+    assert list(data.positions) == [pos for _, pos, _ in expected]
+    assert np.all(data.compressed_counts.config_array[
+        data.compressed_counts.index2uniq][:, :, 1] ==
+                  [derived for _, _, derived in expected])
+
+
+def test_fold_and_subset_populations():
+    demo = simple_five_pop_demo()
+    num_bases = 1000
+    data = demo.simulate_data(
+        num_bases, recoms_per_gen=0,
+        num_replicates=20,
+        muts_per_gen=.5/num_bases,
+        sampled_n_dict=dict(zip(demo.leafs, [4]*5)))
+    sfs = data.extract_sfs(5)
+
+    def fold(config):
+        a, d = tuple(c[0] for c in config), tuple(c[1] for c in config)
+        return config if a >= d else tuple(c[::-1] for c in config)
+
+    pops = list(sfs.sampled_pops)
+    sub_pops = [pops[3], pops[0], pops[1]]
+    sub_idxs = [pops.index(p) for p in sub_pops]
+
+    def subset(config):
+        return tuple(config[i] for i in sub_idxs)
+
+    for sub_sfs, func in [(sfs.fold(), fold),
+                          (sfs.subset_populations(sub_pops), subset)]:
+        for locus, sub_locus in zip(sfs.to_dict(vector=True),
+                                    sub_sfs.to_dict(vector=True)):
+            expected = Counter()
+            for config, count in locus.items():
+                new_config = func(config)
+                # drop configs that are monomorphic in the subsample
+                if (sum(a for a, d in new_config) > 0 and
+                        sum(d for a, d in new_config) > 0):
+                    expected[new_config] += count
+            assert expected == sub_locus
+
+
+@pytest.mark.parametrize("folded", [False, True])
+def test_down_sample(folded):
+    demo = simple_five_pop_demo()
+    num_bases = 1000
+    data = demo.simulate_data(
+        num_bases, recoms_per_gen=0,
+        num_replicates=20,
+        muts_per_gen=.5/num_bases,
+        sampled_n_dict=dict(zip(demo.leafs, [6]*5)))
+    data.use_folded_sfs = folded
+    pops = list(data.populations)
+    sub_n = {pops[0]: 3, pops[2]: 4}
+
+    sub_data = data.down_sample(sub_n)
+    old_configs = data.compressed_counts.config_array[
+        data.compressed_counts.index2uniq]
+    new_configs = sub_data.compressed_counts.config_array[
+        sub_data.compressed_counts.index2uniq]
+    assert list(sub_data.chrom_ids) == list(data.chrom_ids)
+    assert np.all(new_configs <= old_configs)
+    for i, pop in enumerate(pops):
+        assert np.all(new_configs[:, i, :].sum(axis=1) ==
+                      sub_n.get(pop, old_configs[:, i, :].sum(axis=1)))
+
+    def subsample_probs(config):
+        probs = Counter({config: 1.0})
+        for pop, n in sub_n.items():
+            i = pops.index(pop)
+            new_probs = Counter()
+            for c, p in probs.items():
+                a, d = c[i]
+                for new_a in range(n+1):
+                    new_c = c[:i] + ((new_a, n - new_a),) + c[i+1:]
+                    new_probs[new_c] += p * scipy.stats.hypergeom.pmf(
+                        new_a, a + d, a, n)
+            probs = new_probs
+        return probs
+
+    sfs = data.extract_sfs(3)
+    sub_sfs = data.down_sample(sub_n, expected=True, n_blocks=3)
+    assert sub_sfs.folded == folded
+    for locus, sub_locus in zip(sfs.to_dict(vector=True),
+                                sub_sfs.to_dict(vector=True)):
+        expected = Counter()
+        for config, count in locus.items():
+            for c, p in subsample_probs(config).items():
+                if folded and tuple(a for a, d in c) < tuple(d for a, d in c):
+                    c = tuple((d, a) for a, d in c)
+                if sum(a for a, d in c) > 0 and sum(d for a, d in c) > 0:
+                    expected[c] += count * p
+        expected = {k: v for k, v in expected.items() if v > 1e-12}
+        assert set(expected) == set(sub_locus)
+        assert np.allclose([expected[k] for k in expected],
+                           [sub_locus[k] for k in expected])
+
+
+def test_sfs_merge():
+    demo = simple_five_pop_demo()
+    num_bases = 1000
+    data = demo.simulate_data(
+        num_bases, recoms_per_gen=0,
+        num_replicates=30,
+        muts_per_gen=.5/num_bases,
+        sampled_n_dict=dict(zip(demo.leafs, [4]*5)))
+    sfs = data.extract_sfs(None)
+
+    chroms = np.array(list(data.chrom_ids))
+    pieces = [data.filter((chroms >= lo) & (chroms < hi))
+              for lo, hi in [(0, 5), (5, 6), (6, 30)]]
+    for p in pieces:
+        p.length = data.length / 3.
+    sfs_pieces = [p.extract_sfs(None) for p in pieces]
+
+    merged = sfs_pieces[0].merge(*sfs_pieces[1:])
+    assert merged == sfs
+    assert merged.length == data.length
+
+    builder = momi.SfsBuilder()
+    for p in sfs_pieces:
+        builder.add(p)
+    assert builder.build() == sfs
+
+    # building in between adds
+    builder = momi.SfsBuilder(sfs_pieces[0])
+    assert builder.build() == sfs_pieces[0]
+    for p in sfs_pieces[1:]:
+        builder.add(p)
+    assert builder.build() == sfs
+    assert builder.build() == sfs
+
+    # same populations, in a different order
+    pops = list(sfs.sampled_pops)
+    merged = sfs_pieces[0].merge(
+        sfs_pieces[1].subset_populations(pops[::-1]), sfs_pieces[2])
+    assert merged == sfs
+
+    with pytest.raises(ValueError):
+        sfs_pieces[0].merge(sfs_pieces[1].fold())
+
+
+def test_sort_configs():
+    configs = np.random.randint(0, 3, size=(500, 3, 2))
+    index2uniq = np.random.randint(0, 500, size=1000)
+    compressed = CompressedAlleleCounts(configs, index2uniq)
+
+    def key(config):
+        a, d = tuple(config[:, 0]), tuple(config[:, 1])
+        return (tuple(config.sum(axis=1)), min(a, d))
+    sorted_idxs = sorted(range(len(configs)), key=lambda i: key(configs[i]))
+    assert np.all(compressed.config_array == configs[sorted_idxs])
+    assert np.all(compressed.config_array[compressed.index2uniq] ==
+                  configs[index2uniq])
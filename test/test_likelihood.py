@@ -37,6 +37,98 @@ def test_batches():
                       momi.likelihood._composite_log_likelihood(sfs, demo, vector=True))
 
 
+@pytest.mark.parametrize("folded", (True, False))
+def test_batches_missing_data(folded):
+    demo = simple_five_pop_demo(np.random.RandomState(1).normal(size=30))
+    sampled_n_dict = dict(zip(demo.leafs, [4]*5))
+    demo = demo._get_demo(sampled_n_dict)
+
+    # random configs, with missing alleles
+    rng = np.random.RandomState(2)
+    counts = {}
+    while len(counts) < 60:
+        sizes = rng.randint(1, 5, size=5)
+        derived = rng.binomial(sizes, .4)
+        if 0 < derived.sum() < sizes.sum():
+            config = tuple((int(n - d), int(d)) for n, d in zip(sizes, derived))
+            counts[config] = rng.randint(1, 10)
+    sfs = momi.site_freq_spectrum(demo.sampled_pops, [counts])
+    assert sfs.configs.has_missing_data
+
+    surface = SfsLikelihoodSurface(sfs, batch_size=7, folded=folded)
+    assert len(surface.sfs_batches) > 1
+    kwargs = dict(folded=folded, truncate_probs=1e-100)
+    assert np.isclose(surface.log_lik(demo),
+                      momi.likelihood._composite_log_likelihood(
+                          surface.sfs, demo, **kwargs))
+
+    x0 = np.random.RandomState(1).normal(size=30)
+    demo_func = lambda *x: simple_five_pop_demo(
+        np.array(x))._get_demo(sampled_n_dict)
+    surface = SfsLikelihoodSurface(
+        sfs, demo_func=demo_func, batch_size=7, folded=folded)
+    assert np.allclose(
+        grad(surface.log_lik)(x0),
+        grad(lambda x: momi.likelihood._composite_log_likelihood(
+            surface.sfs, demo_func(*x), **kwargs))(x0))
+
+
+def test_vector_log_lik():
+    demo = simple_five_pop_demo()
+    pops = demo.leafs
+    sampled_n_dict = dict(zip(pops, [5]*5))
+    num_bases = 1000
+    sfs = demo.simulate_data(
+        length=num_bases,
+        muts_per_gen=.1/num_bases,
+        recoms_per_gen=0,
+        num_replicates=100,
+        sampled_n_dict=sampled_n_dict).extract_sfs(10)
+
+    demo_func = lambda *x: simple_five_pop_demo(
+        x=np.array(x))._get_demo(sampled_n_dict)
+    x0 = np.random.normal(size=30)
+
+    vec = lambda x: momi.likelihood._composite_log_likelihood(
+        sfs, demo_func(*x), vector=True)
+    scalar = lambda x: momi.likelihood._composite_log_likelihood(
+        sfs, demo_func(*x))
+
+    log_probs = np.log(momi.expected_sfs(
+        demo_func(*x0), sfs.configs, normalized=True))
+    loci_sums = [np.sum(log_probs[idxs] * counts)
+                 for idxs, counts in zip(sfs.loc_idxs, sfs.loc_counts)]
+    assert np.allclose(vec(x0), loci_sums)
+    assert np.allclose(grad(lambda x: np.sum(vec(x)))(x0), grad(scalar)(x0))
+
+
+def test_score_cov():
+    demo = simple_five_pop_demo()
+    pops = demo.leafs
+    sampled_n_dict = dict(zip(pops, [5]*5))
+    num_bases = 1000
+    sfs = demo.simulate_data(
+        length=num_bases,
+        muts_per_gen=.1/num_bases,
+        recoms_per_gen=0,
+        num_replicates=100,
+        sampled_n_dict=sampled_n_dict).extract_sfs(10)
+
+    demo_func = lambda *x: simple_five_pop_demo(
+        x=np.array(x))._get_demo(sampled_n_dict)
+    x0 = np.random.normal(size=30)
+
+    def f_vec(x):
+        ret = momi.likelihood._composite_log_likelihood(
+            sfs, demo_func(*x), mut_rate=1., vector=True)
+        return ret - np.mean(ret)
+    j = jacobian(f_vec)(x0)
+
+    assert np.allclose(
+        np.einsum('ij, ik', j, j),
+        momi.likelihood._score_cov(sfs, demo_func, x0, mut_rate=1.,
+                                   batch_size=5))
+
 
 # TODO does this test still make sense?
 # uses obsolete style of demo functions which I think makes it slow
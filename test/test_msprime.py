@@ -123,3 +123,39 @@ if __name__ == "__main__":
     demo = demo.demo_hist._get_multipop_moran(demo.pops, demo.n)
     treeseq = demo.simulate_trees(mutation_rate=1)
     seg_sites = demo.simulate_data(mutation_rate=1)
+
+
+def test_treeseq_config_chunks():
+    import msprime
+    from momi.demography import _treeseq_config_chunks
+    sampled_n = np.array([3, 5, 4])
+    ts = msprime.simulate(sample_size=sum(sampled_n), length=1e4,
+                          recombination_rate=1e-8, mutation_rate=1e-7,
+                          Ne=1e4, random_seed=1)
+    assert ts.num_sites > 10
+
+    expected = []
+    for v in ts.variants():
+        derived = np.array([np.sum(g) for g in np.split(
+            v.genotypes, np.cumsum(sampled_n)[:-1])])
+        expected.append(np.array([sampled_n - derived, derived]).T)
+
+    chunks = list(_treeseq_config_chunks(ts, sampled_n, chunk_size=7))
+    assert all(len(configs) <= 7 for _, configs in chunks)
+    assert np.all(np.concatenate([configs for _, configs in chunks]) ==
+                  np.array(expected))
+    assert np.all(np.concatenate([pos for pos, _ in chunks]) ==
+                  [site.position for site in ts.sites()])
+
+    (positions, configs), = _treeseq_config_chunks(ts, sampled_n)
+    assert np.all(configs == np.array(expected))
+
+
+def test_simulate_data_processes():
+    demo = simple_admixture_3pop()
+    kwargs = dict(length=1e4, recoms_per_gen=1e-8, muts_per_gen=1e-7,
+                  num_replicates=40, sampled_n_dict={"a": 4, "b": 4, "c": 6},
+                  random_seed=1234)
+    data = demo.simulate_data(processes=1, **kwargs)
+    assert data == demo.simulate_data(processes=None, **kwargs)
+    assert data == demo.simulate_data(processes=3, **kwargs)
@@ -49,3 +49,21 @@ def test_tree_demo_rank1tensor():
 def test_admixture_demo_rank1tensor():
     demo = simple_admixture_demo()
     check_random_tensor(demo._get_demo({"a":4,"b":5}))
+
+
+@pytest.mark.parametrize("batch_size", (-1, 1, 7))
+def test_sfs_tensor_prod_batches(batch_size):
+    demo = simple_admixture_demo()._get_demo({"a": 4, "b": 5})
+    config_list = momi.data.configurations.build_full_config_list(
+        demo.sampled_pops, demo.sampled_n)
+    esfs = expected_sfs(demo, config_list)
+    sfs = momi.site_freq_spectrum(
+        demo.sampled_pops,
+        [{tuple(map(tuple, c)): s for c, s in zip(config_list, esfs)}])
+
+    vecs = [np.random.normal(size=(10, n + 1)) for n in demo.sampled_n]
+    expected = sum(
+        val * np.prod([d[:, i] for d, (_, i) in zip(vecs, config)], axis=0)
+        for config, val in zip(sfs.configs.value, sfs._total_freqs))
+    assert np.allclose(sfs_tensor_prod(sfs, vecs, batch_size=batch_size),
+                       expected)
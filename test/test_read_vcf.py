@@ -5,6 +5,8 @@ import io
 import vcf
 import collections as co
 import subprocess as sp
+import numpy as np
+import pysam
 
 def test_read_vcf():
     sampled_n_dict = {"a":4,"b":4,"c":6}
@@ -60,3 +62,215 @@ def test_read_vcf_folded():
     assert data._sfs.fold() == data2._sfs.subset_populations(data._sfs.sampled_pops).fold()
 
     # TODO: test that concatenating datasets from multiple vcfs works?
+
+def test_read_vcf_processes(tmpdir):
+    sampled_n_dict = {"a":4,"b":4,"c":6}
+    demo = demo_utils.simple_admixture_3pop()
+    theta = 100.0
+    rho = 100.0
+    num_bases = 1e5
+
+    vcf_prefix = str(tmpdir.join("test_vcf_processes"))
+    demo.simulate_vcf(
+        vcf_prefix, recoms_per_gen=rho/num_bases,
+        length=num_bases, muts_per_gen=theta/num_bases,
+        sampled_n_dict=sampled_n_dict, random_seed=1234,
+        force=True)
+
+    bed_file = str(tmpdir.join("regions.bed"))
+    with open(bed_file, "w") as bed:
+        for start, end in [(0, 20000), (20000, 55000), (60000, 100000)]:
+            print(1, start, end, sep="\t", file=bed)
+
+    ind2pop = {f"{pop}_{i}": pop for pop, n in sampled_n_dict.items() for i in range(n)}
+    data = momi.SnpAlleleCounts.read_vcf(
+        vcf_prefix + ".vcf.gz", ind2pop, bed_file=bed_file)
+    data2 = momi.SnpAlleleCounts.read_vcf(
+        vcf_prefix + ".vcf.gz", ind2pop, bed_file=bed_file, processes=2)
+
+    assert data == data2
+    assert data.length == data2.length == 95000
+
+def test_read_vcf_processes_contig_order(tmpdir):
+    # contigs in a different order in the header and in the records
+    vcf_file = str(tmpdir.join("test_contig_order.vcf"))
+    rng = np.random.RandomState(1)
+    with open(vcf_file, "w") as f:
+        print("##fileformat=VCFv4.2", file=f)
+        for chrom in ["1", "2", "3"]:
+            print("##contig=<ID={}>".format(chrom), file=f)
+        print('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+              file=f)
+        print("#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO",
+              "FORMAT", "x", "y", sep="\t", file=f)
+        for chrom in ["2", "3", "1"]:
+            for pos in range(100, 1100, 100):
+                print(chrom, pos, ".", "A", "T", ".", "PASS", ".", "GT",
+                      *["{}|{}".format(*rng.randint(2, size=2))
+                        for _ in range(2)], sep="\t", file=f)
+    vcf_file = pysam.tabix_index(vcf_file, preset="vcf", force=True)
+
+    ind2pop = {"x": "a", "y": "b"}
+    data = momi.SnpAlleleCounts.read_vcf(
+        vcf_file, ind2pop, ancestral_alleles=False)
+    data2 = momi.SnpAlleleCounts.read_vcf(
+        vcf_file, ind2pop, ancestral_alleles=False, processes=2)
+    assert [str(c) for c in data.chrom_ids[::10]] == ["2", "3", "1"]
+    assert data == data2
+
+def test_gt_allele_counts():
+    from momi.data.snps import _gt_allele_counts
+    line = "\t".join(["1", "100", ".", "A", "T", ".", "PASS", "AA=A;DP=10", "GT:DP",
+                      "0|1:3", "1/1:10", "./.:0", "0:1", ".|1:2"]) + "\n"
+    sample_pops = np.array([0, 1, 0, 2, 1])
+    assert np.all(_gt_allele_counts(line, sample_pops, 3) ==
+                  np.array([[1, 1], [0, 3], [1, 0]]))
+
+    # GT not the first FORMAT subfield
+    line = "\t".join(["1", "100", ".", "A", "T", ".", "PASS", ".", "DP:GT",
+                      "11:0/1", "10:1|1"]) + "\n"
+    assert np.all(_gt_allele_counts(line, np.array([0, 1]), 2) ==
+                  np.array([[1, 1], [0, 2]]))
+
+    # no GT
+    line = "\t".join(["1", "100", ".", "A", "T", ".", "PASS", ".", "DP",
+                      "11", "10"]) + "\n"
+    assert _gt_allele_counts(line, np.array([0, 1]), 2) is None
+
+def test_read_vcf_format(tmpdir):
+    vcf_file = str(tmpdir.join("test_format.vcf"))
+    with open(vcf_file, "w") as f:
+        print("##fileformat=VCFv4.2", file=f)
+        print("##contig=<ID=1>", file=f)
+        print('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+              file=f)
+        print('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Depth">',
+              file=f)
+        print("#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO",
+              "FORMAT", "x", "y", sep="\t", file=f)
+        for pos, fmt, x, y in [(100, "DP:GT", "11:0/1", "10:1|1"),
+                               (200, "DP", "11", "10"),
+                               (300, "GT:DP", "0/0", "0|1:3")]:
+            print(1, pos, ".", "A", "T", ".", "PASS", ".", fmt, x, y,
+                  sep="\t", file=f)
+
+    data = momi.SnpAlleleCounts.read_vcf(
+        vcf_file, {"x": "a", "y": "b"}, ancestral_alleles=False)
+    assert list(data.positions) == [100, 300]
+    configs = data.compressed_counts.config_array[
+        data.compressed_counts.index2uniq]
+    assert np.all(configs == [[[1, 1], [0, 2]], [[2, 0], [1, 1]]])
+
+def test_genomic_index(tmpdir):
+    sampled_n_dict = {"a":4,"b":4,"c":6}
+    demo = demo_utils.simple_admixture_3pop()
+    theta = 100.0
+    rho = 100.0
+    num_bases = 1e5
+
+    vcf_prefix = str(tmpdir.join("test_vcf_index"))
+    demo.simulate_vcf(
+        vcf_prefix, recoms_per_gen=rho/num_bases,
+        length=num_bases, muts_per_gen=theta/num_bases,
+        sampled_n_dict=sampled_n_dict, random_seed=1234,
+        force=True)
+
+    bed_file = str(tmpdir.join("regions.bed"))
+    with open(bed_file, "w") as bed:
+        for start, end in [(60000, 100000), (100, 20000), (20000, 55000)]:
+            print(1, start, end, sep="\t", file=bed)
+
+    ind2pop = {f"{pop}_{i}": pop for pop, n in sampled_n_dict.items() for i in range(n)}
+    data = momi.SnpAlleleCounts.read_vcf(vcf_prefix + ".vcf.gz", ind2pop)
+    bed_data = momi.SnpAlleleCounts.read_vcf(
+        vcf_prefix + ".vcf.gz", ind2pop, bed_file=bed_file)
+
+    masked = data.mask_bed(bed_file)
+    assert masked.length == bed_data.length == 94900
+    assert np.all(np.sort(masked.positions) == np.sort(bed_data.positions))
+    assert masked.extract_sfs(None) == bed_data.extract_sfs(None)
+
+    excluded = data.mask_bed(bed_file, exclude=True)
+    assert np.all((excluded.positions <= 100) |
+                  (excluded.positions > 55000) & (excluded.positions <= 60000))
+    assert len(excluded) + len(masked) == len(data)
+
+    region = data.region("1", 20000, 55000)
+    in_region = (data.positions > 20000) & (data.positions <= 55000)
+    assert np.all(region.positions == data.positions[in_region])
+    assert region.compressed_counts.config_array is data.compressed_counts.config_array
+    assert len(data.region("2")) == 0
+
+    block_bp = 10000
+    sfs = data.extract_sfs(None, block_bp=block_bp)
+    blocks = np.floor(data.positions[data.is_polymorphic] / block_bp)
+    assert sfs.n_loci == len(set(blocks))
+    for block, locus in zip(sorted(set(blocks)), sfs.to_dict(vector=True)):
+        # blocks are [start, end), regions are (start, end]
+        block_sfs = data.region(
+            1, block * block_bp - 1, (block + 1) * block_bp - 1)
+        assert locus == block_sfs.extract_sfs(None).to_dict()
+
+@pytest.mark.parametrize("ancestral_alleles", [True, False])
+def test_read_vcf_sfs(tmpdir, ancestral_alleles):
+    sampled_n_dict = {"a":4,"b":4,"c":6}
+    demo = demo_utils.simple_admixture_3pop()
+    theta = 100.0
+    rho = 100.0
+    num_bases = 1e5
+
+    vcf_prefix = str(tmpdir.join("test_vcf_sfs"))
+    demo.simulate_vcf(
+        vcf_prefix, recoms_per_gen=rho/num_bases,
+        length=num_bases, muts_per_gen=theta/num_bases,
+        sampled_n_dict=sampled_n_dict, random_seed=1234,
+        force=True, print_aa=ancestral_alleles)
+
+    ind2pop = {f"{pop}_{i}": pop for pop, n in sampled_n_dict.items() for i in range(n)}
+    data = momi.SnpAlleleCounts.read_vcf(
+        vcf_prefix + ".vcf.gz", ind2pop, ancestral_alleles=ancestral_alleles)
+
+    assert momi.read_vcf_sfs(
+        vcf_prefix + ".vcf.gz", ind2pop,
+        ancestral_alleles=ancestral_alleles) == data.extract_sfs(None)
+    assert momi.read_vcf_sfs(
+        vcf_prefix + ".vcf.gz", ind2pop, block_bp=10000,
+        ancestral_alleles=ancestral_alleles) == data.extract_sfs(
+            None, block_bp=10000)
+
+    sfs = momi.read_vcf_sfs(
+        vcf_prefix + ".vcf.gz", ind2pop, n_blocks=10,
+        ancestral_alleles=ancestral_alleles)
+    assert sfs.n_loci == 10
+    assert sfs.combine_loci() == data.extract_sfs(10).combine_loci()
+    assert sfs.folded == (not ancestral_alleles)
+
+@pytest.mark.parametrize("ploidy,print_aa", [(1, True), (2, False)])
+def test_simulate_vcf_counts(tmpdir, ploidy, print_aa):
+    sampled_n_dict = {"a":4,"b":4,"c":6}
+    demo = demo_utils.simple_admixture_3pop()
+    num_bases = 1e5
+
+    vcf_prefix = str(tmpdir.join("test_vcf_counts"))
+    demo.simulate_vcf(
+        vcf_prefix, recoms_per_gen=1e-3, length=num_bases,
+        muts_per_gen=1e-3, sampled_n_dict=sampled_n_dict, ploidy=ploidy,
+        random_seed=1234, force=True, print_aa=print_aa, write_counts=True)
+
+    ind2pop = {f"{pop}_{i}": pop for pop, n in sampled_n_dict.items()
+               for i in range(n // ploidy)}
+    data = momi.SnpAlleleCounts.read_vcf(
+        vcf_prefix + ".vcf.gz", ind2pop, ancestral_alleles=print_aa,
+        bed_file=vcf_prefix + ".bed")
+    counts = momi.SnpAlleleCounts.load(vcf_prefix + ".momi")
+    assert len(counts) > 0
+    counts = counts.subset_populations(data.populations)
+
+    def snp_configs(snps):
+        return snps.compressed_counts.config_array[
+            snps.compressed_counts.index2uniq]
+
+    assert np.all(snp_configs(counts) == snp_configs(data))
+    assert np.all(counts.positions == data.positions)
+    assert counts.length == data.length
+    assert counts.use_folded_sfs == data.use_folded_sfs == (not print_aa)
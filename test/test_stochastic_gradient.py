@@ -3,6 +3,8 @@ import pytest
 import momi
 from momi import expected_sfs
 import momi.likelihood
+import momi.optimizers
+import autograd
 from demo_utils import simple_admixture_demo
 import autograd.numpy as np
 import itertools
@@ -50,6 +52,59 @@ def test_subconfigs(fold, normalized):
     assert np.allclose(val1, val2)
 
 
+@pytest.mark.parametrize("method", ("saga", "sag"))
+def test_gradient_table_optimizers(method):
+    # least squares split into minibatches;
+    # gradient table methods should converge to the exact minimum
+    rgen = np.random.RandomState(123)
+    n_pieces = 10
+    A = rgen.normal(size=(n_pieces, 5, 3))
+    b = rgen.normal(size=(n_pieces, 5))
+
+    def piece_fun(x, i):
+        if i is None:
+            return np.mean([piece_fun(x, j) for j in range(n_pieces)])
+        return .5 * np.sum((np.dot(A[i], x) - b[i])**2)
+
+    x_true = np.linalg.lstsq(np.concatenate(A), np.concatenate(b))[0]
+
+    res = momi.optimizers.stochastic_opts[method](
+        piece_fun, np.zeros(3), autograd.value_and_grad(piece_fun),
+        pieces=n_pieces, stepsize=.02, num_iters=5000, rgen=rgen,
+        xtol=1e-10)
+    assert np.allclose(res.x, x_true, atol=1e-4)
+
+
+def test_adam_minibatches_per_step():
+    # least squares split into minibatches; with SVRG,
+    # adam should converge to the exact minimum
+    rgen = np.random.RandomState(123)
+    n_pieces = 10
+    A = rgen.normal(size=(n_pieces, 5, 3))
+    b = rgen.normal(size=(n_pieces, 5))
+
+    evaluated = Counter()
+
+    def piece_fun(x, i):
+        if i is None:
+            return sum(piece_fun(x, j) for j in range(n_pieces)) / n_pieces
+        evaluated[i] += 1
+        return .5 * np.sum((np.dot(A[i], x) - b[i])**2)
+
+    x_true = np.linalg.lstsq(np.concatenate(A), np.concatenate(b))[0]
+
+    num_iters = 2000
+    res = momi.optimizers.adam(
+        piece_fun, np.zeros(3), autograd.value_and_grad(piece_fun),
+        pieces=n_pieces, stepsize=.02, num_iters=num_iters, rgen=rgen,
+        svrg_epoch=20, minibatches_per_step=3, xtol=-1)
+    assert np.allclose(res.x, x_true, atol=1e-4)
+    # 3 minibatches at x, and 3 at the SVRG pivot, per step
+    n_pivots = (num_iters - 1) // 20
+    assert sum(evaluated.values()) == (
+        3 * num_iters + 3 * (num_iters - 20) + n_pivots * n_pieces)
+
+
 #@pytest.mark.parametrize("fold,use_mut",
 #                         ((random.choice((True, False)), random.choice((True, False))),))
 #def test_subsfs(fold, use_mut):
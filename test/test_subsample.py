@@ -125,3 +125,66 @@ def test_subsample_pops():
     sfs1 = data.subset_populations([1,2,3], [3]).extract_sfs(None)
     sfs2 = data.extract_sfs(None).subset_populations([1,2,3], [3])
     assert sfs1 == sfs2
+
+
+def test_leaf_vecs():
+    from momi.data.configurations import _leaf_vecs
+    n = 7
+    configs = np.array([(-1, 1), (0, 0), (2, 1), (0, 3), (4, 3)])
+    vecs = _leaf_vecs(configs, n)
+    for (a, d), vec in zip(configs, vecs):
+        for der, v in enumerate(vec):
+            # P(subsample a ancestral and d derived | der derived alleles)
+            expected = (scipy.special.comb(der, d) *
+                        scipy.special.comb(n - der, a) /
+                        scipy.special.comb(n, a + d))
+            assert np.isclose(v, expected)
+
+    # too large for scipy.special.comb
+    n = 2000
+    vecs = _leaf_vecs(np.array([(600, 600), (0, 1)]), n)
+    assert np.all(np.isfinite(vecs))
+    assert np.allclose(vecs[1], np.arange(n + 1) / n)
+
+
+@pytest.mark.parametrize("folded", (True, False))
+def test_augmented_configs(folded):
+    from momi.data.configurations import (
+        build_config_list, _ConfigList_Subset)
+    configs = build_config_list(
+        ["a", "b", "c"],
+        np.array([[[2, 1], [3, 0], [1, 1]],
+                  [[1, 2], [0, 3], [1, 1]],
+                  [[1, 1], [0, 0], [1, 1]],
+                  [[0, 2], [2, 1], [0, 1]]]),
+        sampled_n=None, ascertainment_pop=[True, True, False])
+    aug, idxs = configs._build_augmented_configs_idxs(folded)
+    assert len(np.unique(aug.reshape(len(aug), -1), axis=0)) == len(aug)
+
+    assert np.all(aug[idxs["idx_2_row"]] == configs.value)
+    assert np.all(aug[idxs["denom_idx"]] == 0)
+    sample_sizes = configs.value.sum(axis=2) * [1, 1, 0]
+    assert np.all(aug[idxs[("corrections_2_denom", 0)]][:, :, 0] ==
+                  sample_sizes)
+    assert np.all(aug[idxs[("corrections_2_denom", 1)]][:, :, 1] ==
+                  sample_sizes)
+    if folded:
+        # the symmetric config maps to the "zero" config
+        null_config = np.array([(-1, 1)] * 3)
+        assert np.all(aug[idxs["folded_2_row"][2]] == null_config)
+        for i in (0, 1, 3):
+            assert np.all(aug[idxs["folded_2_row"][i]] ==
+                          configs.value[i, :, ::-1])
+    else:
+        assert "folded_2_row" not in idxs
+
+    sub_idxs = np.array([3, 1])
+    sub = _ConfigList_Subset(configs, sub_idxs)
+    sub_aug, sub_idxs_dict = (sub._augmented_configs(folded),
+                              sub._augmented_idxs(folded))
+    assert sub_idxs_dict.keys() == idxs.keys()
+    for k, v in sub_idxs_dict.items():
+        if k == "denom_idx":
+            assert np.all(sub_aug[v] == aug[idxs[k]])
+        else:
+            assert np.all(sub_aug[v] == aug[idxs[k][sub_idxs]])